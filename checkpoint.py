@@ -0,0 +1,62 @@
+import json
+import os
+from pathlib import Path
+
+
+class Checkpoint:
+    """
+    Append-only JSONL log of finished results, keyed by Zotero item ID or DOI.
+    Each result is flushed to disk as soon as it is appended, so a crash or Ctrl-C
+    loses at most the line being written. A truncated last line is ignored when
+    the file is loaded, and a key appended twice keeps its latest record.
+    """
+
+    def __init__(self, path: Path, fsync: bool = False):
+        self.path = Path(path)
+        self.fsync = fsync
+        self.records: dict[str, dict] = {}
+        if self.path.exists():
+            self._load()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._fp = self.path.open("a", encoding="utf-8")
+
+    def _load(self):
+        with self.path.open("rb") as fp:
+            data = fp.read()
+        for line in data.splitlines():
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                # Partially written line from an interrupted run
+                continue
+            self.records[entry["key"]] = entry["record"]
+        if data and not data.endswith(b"\n"):
+            # Start the next record on a fresh line after a truncated one
+            with self.path.open("ab") as fp:
+                fp.write(b"\n")
+
+    def __contains__(self, key) -> bool:
+        return key in self.records
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def append(self, key: str, record: dict):
+        """
+        Write a finished result. Values that are not JSON types are stored as strings.
+        """
+        entry = json.dumps({"key": key, "record": record}, default=str)
+        self._fp.write(entry + "\n")
+        self._fp.flush()
+        if self.fsync:
+            os.fsync(self._fp.fileno())
+        self.records[key] = record
+
+    def close(self):
+        self._fp.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
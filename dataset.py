@@ -0,0 +1,40 @@
+import shutil
+import polars as pl
+from pathlib import Path
+from urllib.parse import quote
+
+OUTPUT_DIR = Path("./output")
+# Parquet datasets of processed papers, written by `process_zotero` and
+# `process_export`
+ZOTERO_DATASET_PATH = OUTPUT_DIR / "zotero_items"
+WOS_DATASET_PATH = OUTPUT_DIR / "processed_wos"
+# Directory name of the partition of null values, as in Hive
+NULL_PARTITION = "__HIVE_DEFAULT_PARTITION__"
+
+
+def reset_dataset(path: Path):
+    """
+    Remove a dataset written by a previous run.
+    """
+    shutil.rmtree(path, ignore_errors=True)
+
+
+def write_dataset(df: pl.DataFrame, path: Path, partition_by: str, part: int = 0):
+    """
+    Write a DataFrame as Hive partitioned Parquet: one `<column>=<value>` directory
+    per value of `partition_by`. Chunks of the same dataset are written with
+    different `part` numbers so they can be added one at a time.
+    """
+    partitions = df.partition_by(partition_by, as_dict=True, include_key=False)
+    for (value,), partition in partitions.items():
+        name = NULL_PARTITION if value is None else quote(str(value), safe="")
+        directory = path / f"{partition_by}={name}"
+        directory.mkdir(parents=True, exist_ok=True)
+        partition.write_parquet(directory / f"part-{part:05d}.parquet")
+
+
+def scan_dataset(path: Path) -> pl.LazyFrame:
+    """
+    Lazily read a dataset written by `write_dataset`, with its partition column.
+    """
+    return pl.scan_parquet(path / "**" / "*.parquet", hive_partitioning=True)
@@ -0,0 +1,279 @@
+import re
+import unicodedata
+import zlib
+import numpy as np
+import polars as pl
+from dataclasses import dataclass
+from doi import normalize_doi
+from link_resolver import doi_from_link, normalize_link
+from pathlib import Path
+from typing import Iterable, Iterator
+from zotero_store import STORE_PATH, ZoteroStore
+
+PATH = Path(".")
+WOS_PATH = PATH / "export_wos.xls"
+SCHOLAR_LINKS_PATH = PATH / "paper_links.txt"
+# Number of MinHash permutations, split in bands of rows for LSH.
+# Pairs with a Jaccard similarity above about (1 / BANDS) ** (1 / ROWS) = 0.42
+# are very likely to share a bucket and become candidates.
+PERMUTATIONS = 128
+BANDS = 32
+ROWS = PERMUTATIONS // BANDS
+# Candidates are only kept as duplicates above these Jaccard similarities
+TITLE_THRESHOLD = 0.8
+ABSTRACT_THRESHOLD = 0.6
+# Large Mersenne prime for the universal hash functions of MinHash
+MERSENNE_PRIME = (1 << 61) - 1
+# Buckets holding more records are skipped, comparing all their pairs is
+# quadratic and they come from boilerplate shared by unrelated records
+MAX_BUCKET_SIZE = 100
+
+
+@dataclass
+class Record:
+    """
+    A paper as found in one source, with the fields used for deduplication.
+    """
+
+    source: str
+    id: str
+    doi: str | None = None
+    title: str | None = None
+    abstract: str | None = None
+
+
+def normalize_text(text: str | None) -> str:
+    """
+    Lowercase ASCII words of a text, punctuation and accents are removed.
+    """
+    if not text:
+        return ""
+    text = unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode()
+    return " ".join(re.findall(r"[a-z0-9]+", text.lower()))
+
+
+def shingles(text: str, size: int, words: bool = False) -> set[str]:
+    """
+    Overlapping character (or word) n-grams of a normalized text.
+    """
+    tokens = text.split() if words else text
+    if len(tokens) <= size:
+        return {" ".join(tokens) if words else tokens} if tokens else set()
+    if words:
+        return {" ".join(tokens[i : i + size]) for i in range(len(tokens) - size + 1)}
+    return {tokens[i : i + size] for i in range(len(tokens) - size + 1)}
+
+
+def jaccard(a: set, b: set) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+class MinHashLSH:
+    """
+    Locality sensitive hashing index of MinHash signatures.
+    Each signature is cut in `bands`, and records sharing any band are candidate
+    duplicates. Finding candidates is linear in the number of records instead
+    of comparing every pair.
+    """
+
+    def __init__(
+        self,
+        permutations: int = PERMUTATIONS,
+        bands: int = BANDS,
+        seed: int = 0,
+        max_bucket_size: int = MAX_BUCKET_SIZE,
+    ):
+        self.bands = bands
+        self.max_bucket_size = max_bucket_size
+        self.rows = permutations // bands
+        rng = np.random.default_rng(seed)
+        # a * h + b stays below 2 ** 64 for 32-bit shingle hashes
+        self.a = rng.integers(1, 1 << 31, permutations, dtype=np.uint64)
+        self.b = rng.integers(0, 1 << 31, permutations, dtype=np.uint64)
+        self.buckets: dict[tuple[int, bytes], list[int]] = {}
+
+    def signature(self, shingle_set: set[str]) -> np.ndarray:
+        hashes = np.fromiter(
+            (zlib.crc32(shingle.encode()) for shingle in shingle_set),
+            dtype=np.uint64,
+            count=len(shingle_set),
+        )
+        return ((np.outer(self.a, hashes) + self.b[:, None]) % MERSENNE_PRIME).min(
+            axis=1
+        )
+
+    def add(self, index: int, shingle_set: set[str]):
+        if not shingle_set:
+            return
+        signature = self.signature(shingle_set).reshape(self.bands, self.rows)
+        for band, rows in enumerate(signature):
+            self.buckets.setdefault((band, rows.tobytes()), []).append(index)
+
+    def candidates(self) -> set[tuple[int, int]]:
+        """
+        Pairs of indexes sharing at least one bucket, buckets larger than
+        `max_bucket_size` are skipped.
+        """
+        pairs = set()
+        for indexes in self.buckets.values():
+            if len(indexes) > self.max_bucket_size:
+                continue
+            for i, first in enumerate(indexes):
+                for second in indexes[i + 1 :]:
+                    pairs.add((first, second))
+        return pairs
+
+
+class UnionFind:
+    def __init__(self, size: int):
+        self.parent = list(range(size))
+
+    def find(self, index: int) -> int:
+        while self.parent[index] != index:
+            self.parent[index] = self.parent[self.parent[index]]
+            index = self.parent[index]
+        return index
+
+    def union(self, first: int, second: int):
+        first, second = self.find(first), self.find(second)
+        if first != second:
+            self.parent[max(first, second)] = min(first, second)
+
+
+def find_duplicates(
+    records: list[Record],
+    title_threshold: float = TITLE_THRESHOLD,
+    abstract_threshold: float = ABSTRACT_THRESHOLD,
+) -> pl.DataFrame:
+    """
+    Group the records describing the same paper.
+    Records with the same normalized DOI are merged first. Then MinHash/LSH finds
+    candidates among the normalized titles (character 5-grams) and abstracts
+    (word 3-grams), and a candidate pair is merged if its exact Jaccard
+    similarity is above the threshold. Records with different DOIs never end up
+    in the same cluster.
+    Return one row per record with its `cluster` (index of the first record of
+    the cluster), how it was matched, and whether it is the `canonical` record
+    of its cluster: the one to process, with a DOI and the longest abstract.
+    """
+    dois = [normalize_doi(record.doi) for record in records]
+    titles = [shingles(normalize_text(record.title), 5) for record in records]
+    abstracts = [
+        shingles(normalize_text(record.abstract), 3, words=True) for record in records
+    ]
+    clusters = UnionFind(len(records))
+    match = ["" for _ in records]
+
+    first_with_doi: dict[str, int] = {}
+    for index, doi in enumerate(dois):
+        if doi is None:
+            continue
+        if doi in first_with_doi:
+            clusters.union(first_with_doi[doi], index)
+            match[index] = "doi"
+        else:
+            first_with_doi[doi] = index
+    # DOI of each cluster, so that clusters with different DOIs are never merged
+    # even through a record without DOI
+    cluster_doi = {clusters.find(index): doi for doi, index in first_with_doi.items()}
+
+    for shingle_sets, threshold, kind in (
+        (titles, title_threshold, "title"),
+        (abstracts, abstract_threshold, "abstract"),
+    ):
+        lsh = MinHashLSH()
+        for index, shingle_set in enumerate(shingle_sets):
+            lsh.add(index, shingle_set)
+        for first, second in sorted(lsh.candidates()):
+            roots = clusters.find(first), clusters.find(second)
+            if roots[0] == roots[1]:
+                continue
+            first_doi, second_doi = cluster_doi.get(roots[0]), cluster_doi.get(roots[1])
+            if first_doi and second_doi and first_doi != second_doi:
+                continue
+            if jaccard(shingle_sets[first], shingle_sets[second]) >= threshold:
+                clusters.union(first, second)
+                cluster_doi[clusters.find(first)] = first_doi or second_doi
+                match[second] = match[second] or kind
+
+    cluster_ids = [clusters.find(index) for index in range(len(records))]
+    best: dict[int, int] = {}
+    for index, cluster in enumerate(cluster_ids):
+        score = (dois[index] is not None, len(records[index].abstract or ""))
+        current = best.get(cluster)
+        if current is None or score > (
+            dois[current] is not None,
+            len(records[current].abstract or ""),
+        ):
+            best[cluster] = index
+    return pl.DataFrame(
+        {
+            "cluster": cluster_ids,
+            "canonical": [
+                best[cluster] == index for index, cluster in enumerate(cluster_ids)
+            ],
+            "match": match,
+            "source": [record.source for record in records],
+            "id": [record.id for record in records],
+            "doi": dois,
+            "title": [record.title for record in records],
+        },
+        schema_overrides={"doi": pl.Utf8, "title": pl.Utf8},
+    )
+
+
+def wos_records(path: Path = WOS_PATH) -> Iterator[Record]:
+    wos = pl.read_excel(path, columns=["DOI", "Article Title", "Abstract"])
+    for index, row in enumerate(wos.iter_rows()):
+        doi, title, abstract = row
+        yield Record("wos", doi or f"row {index}", doi, title, abstract)
+
+
+def zotero_records(store: ZoteroStore) -> Iterator[Record]:
+    for item in store.values():
+        data = item["data"]
+        if data.get("itemType") in ("attachment", "note"):
+            continue
+        yield Record(
+            "zotero",
+            data["key"],
+            data.get("DOI"),
+            data.get("title"),
+            data.get("abstractNote"),
+        )
+
+
+def scholar_records(path: Path = SCHOLAR_LINKS_PATH) -> Iterator[Record]:
+    """
+    Google Scholar links only have a DOI when the publisher puts it in the URL,
+    it is found by the rules of `link_resolver` on the normalized link.
+    """
+    with path.open("r") as fp:
+        for line in fp:
+            if url := normalize_link(line):
+                yield Record("scholar", url, doi_from_link(url))
+
+
+def load_records(*sources: Iterable[Record]) -> list[Record]:
+    return [record for source in sources for record in source]
+
+
+if __name__ == "__main__":
+    sources = []
+    if WOS_PATH.exists():
+        sources.append(wos_records())
+    if STORE_PATH.exists():
+        sources.append(zotero_records(ZoteroStore()))
+    if SCHOLAR_LINKS_PATH.exists():
+        sources.append(scholar_records())
+    records = load_records(*sources)
+    df = find_duplicates(records)
+    duplicates = df.filter(pl.len().over("cluster") > 1)
+    print(
+        f"Records: {len(df)}, unique papers: {df['canonical'].sum()}, "
+        f"records in duplicate clusters: {len(duplicates)}"
+    )
+    print(df.group_by("match").len().sort("len", descending=True))
+    df.write_csv(PATH / "output" / "duplicates.csv")
@@ -0,0 +1,13 @@
+import re
+
+DOI_PATTERN = re.compile(r"10\.\d{4,9}/[^\s?#&]+", re.IGNORECASE)
+
+
+def normalize_doi(doi: str | None) -> str | None:
+    """
+    Lowercase DOI without its resolver prefix, or None if there is no DOI in it.
+    """
+    if not doi:
+        return None
+    match = DOI_PATTERN.search(doi)
+    return match.group(0).lower().rstrip(".") if match else None
@@ -1,56 +1,207 @@
+import contextlib
+import functools
 import time
+from collections import Counter
 import pyautogui
 import pyperclip
 import cv2 as cv
 import numpy as np
 from mss import mss
 
+TEMPLATE_PATH = "google_scholar_mark.png"
+# Browser zoom levels the template is matched at
+TEMPLATE_SCALES = (0.75, 0.9, 1.0, 1.1, 1.25, 1.5)
+# Area of the primary monitor with the result list, as fractions of its
+# (left, top, width, height)
+RESULTS_REGION = (0.0, 0.0, 0.7, 1.0)
+# Polling of the screen and the clipboard by `wait_until`, in seconds
+POLL_INTERVAL = 0.05
+WAIT_TIMEOUT = 5
+# How long a scroll may take to start moving the page
+SCROLL_START_TIMEOUT = 0.5
+# Mean absolute pixel difference above which a screen region has changed
+CHANGE_THRESHOLD = 1.0
+# Size of the region around the mouse watched for the context menu
+MENU_REGION_SIZE = 300
+# Position of the paper title relative to the mark, in pixels at zoom level 1.0
+TITLE_OFFSET = (45, -70)
+
 paper_links = []
+# Seconds spent in each step of the current page, see `timed`
+timings = Counter()
 
 
-def capture_screen():
-    # Capture main screen
+def capture_region(region=RESULTS_REGION):
+    # Absolute screen region from fractions of the primary monitor
     with mss() as sct:
-        monitor = sct.monitors[1]  # Capture the primary monitor
-        screenshot = sct.grab(monitor)
-        # Convert the screenshot to a format suitable for OpenCV
-        img = np.array(screenshot)
-        # convert from BGRA to BGR
-        img = cv.cvtColor(img, cv.COLOR_BGRA2BGR)
+        screen = sct.monitors[1]
+    left, top, width, height = region
+    return {
+        "left": screen["left"] + int(left * screen["width"]),
+        "top": screen["top"] + int(top * screen["height"]),
+        "width": int(width * screen["width"]),
+        "height": int(height * screen["height"]),
+    }
+
+
+def capture_screen(region=RESULTS_REGION, gray=False):
+    # Capture only the result list area of the main screen
+    monitor = capture_region(region)
+    with mss() as sct:
+        screenshot = np.asarray(sct.grab(monitor))
+    # Convert from BGRA straight to the format needed, grayscale for matching
+    img = cv.cvtColor(screenshot, cv.COLOR_BGRA2GRAY if gray else cv.COLOR_BGRA2BGR)
+    # Locations in the image are relative to the captured region
     return img, monitor
 
 
-def get_link_address() -> str:
+@contextlib.contextmanager
+def timed(step):
+    # Add the time spent in a step to the timings of the current page
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[step] += time.perf_counter() - start
+
+
+def wait_until(condition, timeout=WAIT_TIMEOUT, interval=POLL_INTERVAL):
+    # Poll a condition until it is true, return False if it timed out
+    deadline = time.perf_counter() + timeout
+    while not condition():
+        if time.perf_counter() > deadline:
+            return False
+        time.sleep(interval)
+    return True
+
+
+def grab_region(sct, region):
+    # Small grayscale capture of an absolute screen region, cheap to compare
+    img = cv.cvtColor(np.asarray(sct.grab(region)), cv.COLOR_BGRA2GRAY)
+    return cv.resize(img, None, fx=0.25, fy=0.25, interpolation=cv.INTER_AREA)
+
+
+def region_changed(before, after):
+    return cv.absdiff(before, after).mean() > CHANGE_THRESHOLD
+
+
+def wait_for_change(region, before=None, timeout=WAIT_TIMEOUT):
+    # Wait until a screen region differs from `before` (or from now)
+    with mss() as sct:
+        if before is None:
+            before = grab_region(sct, region)
+        return wait_until(
+            lambda: region_changed(before, grab_region(sct, region)), timeout
+        )
+
+
+def wait_for_stable(region, timeout=WAIT_TIMEOUT):
+    # Wait until a screen region stops changing, e.g. after scrolling
+    with mss() as sct:
+        last = [grab_region(sct, region)]
+
+        def stable():
+            current = grab_region(sct, region)
+            changed = region_changed(last[0], current)
+            last[0] = current
+            return not changed
+
+        return wait_until(stable, timeout)
+
+
+def mouse_region(size=MENU_REGION_SIZE):
+    # Screen region centred on the mouse, menus open below it or above it near
+    # the bottom of the screen. The region is kept inside the primary monitor.
+    x, y = pyautogui.position()
+    screen = capture_region((0.0, 0.0, 1.0, 1.0))
+    width, height = min(size, screen["width"]), min(size, screen["height"])
+    left = min(
+        max(int(x) - width // 2, screen["left"]),
+        screen["left"] + screen["width"] - width,
+    )
+    top = min(
+        max(int(y) - height // 2, screen["top"]),
+        screen["top"] + screen["height"] - height,
+    )
+    return {"left": left, "top": top, "width": width, "height": height}
+
+
+def results_region():
+    # Absolute screen region of the result list
+    return capture_region(RESULTS_REGION)
+
+
+def get_link_address() -> str | None:
+    # Clear the clipboard so that copying the same link twice is still noticed.
+    # Return None if nothing was copied.
+    pyperclip.copy("")
+    region = mouse_region()
+    with mss() as sct:
+        before = grab_region(sct, region)
     # Right click on the mouse
     pyautogui.rightClick()
     # Wait for the context menu to appear
-    time.sleep(0.5)
+    with timed("context menu"):
+        wait_for_change(region, before)
     # Move the mouse to the "Copy link address" option
     pyautogui.move(40, 190)
     # Click to copy the link address
     pyautogui.click()
-    # Get clipboard content
+    # Wait for the link in the clipboard
+    with timed("clipboard"):
+        if not wait_until(lambda: pyperclip.paste() != ""):
+            return None
     link_address = pyperclip.paste()
     return link_address
 
 
-def detect_mark(img, template, threshold=0.8):
-    # Perform template matching
-    result = cv.matchTemplate(
-        cv.cvtColor(img, cv.COLOR_BGR2GRAY), template, cv.TM_CCOEFF_NORMED
+@functools.cache
+def template_pyramid(path=TEMPLATE_PATH, scales=TEMPLATE_SCALES):
+    # Grayscale template resized for each browser zoom level, loaded once
+    template = cv.imread(path, cv.IMREAD_GRAYSCALE)
+    return tuple(
+        cv.resize(
+            template,
+            None,
+            fx=scale,
+            fy=scale,
+            interpolation=cv.INTER_AREA if scale < 1 else cv.INTER_LINEAR,
+        )
+        for scale in scales
+    )
+
+
+def detect_mark(img, templates, threshold=0.8, min_distance=20, scales=TEMPLATE_SCALES):
+    # Return the marks found and the scale of the template matching best, the
+    # browser zoom level. `scales` are the ones of `template_pyramid`.
+    if img.ndim == 3:
+        img = cv.cvtColor(img, cv.COLOR_BGR2GRAY)
+    if isinstance(templates, np.ndarray):
+        templates, scales = (templates,), (1.0,)
+    # Match every scale of the template, keep the zoom level that matches best
+    best, best_scale = None, 1.0
+    for template, scale in zip(templates, scales):
+        if template.shape[0] > img.shape[0] or template.shape[1] > img.shape[1]:
+            continue
+        result = cv.matchTemplate(img, template, cv.TM_CCOEFF_NORMED)
+        if best is None or result.max() > best.max():
+            best, best_scale = result, scale
+    if best is None:
+        return [], best_scale
+    # Non-maximum suppression: keep the points above the threshold that are the
+    # maximum of their neighborhood
+    kernel = np.ones((2 * min_distance + 1, 2 * min_distance + 1), np.uint8)
+    peaks = (best >= threshold) & (best == cv.dilate(best, kernel))
+    # Neighboring pixels with the same score are one mark
+    count, _, _, centroids = cv.connectedComponentsWithStats(peaks.astype(np.uint8))
+    # Skip the background component, sort from top to bottom
+    points = sorted(
+        ((round(x), round(y)) for x, y in centroids[1:count]),
+        key=lambda point: (point[1], point[0]),
     )
-    # Set a threshold for detection
-    loc = np.where(result >= threshold)
-    # If the points are less than 20 pixels apart, consider them as the same point
-    unique_points = []
-    for pt in zip(*loc[::-1]):
-        if all(
-            np.linalg.norm(np.array(pt) - np.array(up)) > 20 for up in unique_points
-        ):
-            unique_points.append(pt)
 
     # # Draw rectangles around detected marks
-    # for pt in unique_points:
+    # for pt in points:
     #     cv.rectangle(
     #         img,
     #         pt,
@@ -62,94 +213,124 @@ def detect_mark(img, template, threshold=0.8):
     # cv.waitKey(0)
     # cv.destroyAllWindows()
 
-    return unique_points
+    return points, best_scale
 
 
-def process_mark_locations(location, monitor, page):
-    # Move to the paper title location
-    time.sleep(0.5)
+def process_mark_locations(location, monitor, page, scale=1.0):
+    # Move to the paper title location, its offset grows with the zoom level
     pyautogui.moveTo(
-        location[0] + monitor["left"] + 45, location[1] + monitor["top"] - 70
+        location[0] + monitor["left"] + round(TITLE_OFFSET[0] * scale),
+        location[1] + monitor["top"] + round(TITLE_OFFSET[1] * scale),
     )
-    time.sleep(0.5)
     # Get the link address
     link_address = get_link_address()
-    if len(paper_links) > 0:
-        if link_address == paper_links[-1] and link_address != "javascript:void(0)":
-            print(f"Found error at page {page + 1}")
-            # Capture the screen for debugging
-            img, monitor = capture_screen()
-            # Mark the location of the error
-            cv.rectangle(
-                img,
-                (location[0] - 50, location[1] - 100),
-                (location[0] + 1000, location[1] + 20),
-                (0, 0, 255),
-                2,
-            )
-            # Save the image for debugging
-            cv.imwrite(
-                f"./temp/error_page_{page + 1}_{location[0]}_{location[1]}.png", img
-            )
-            return
+    # Nothing copied, or the previous link copied again
+    failed = link_address is None or (
+        len(paper_links) > 0
+        and link_address == paper_links[-1]
+        and link_address != "javascript:void(0)"
+    )
+    if failed:
+        print(f"Found error at page {page + 1}")
+        # Capture the screen for debugging
+        img, monitor = capture_screen()
+        # Mark the location of the error
+        cv.rectangle(
+            img,
+            (location[0] - 50, location[1] - 100),
+            (location[0] + 1000, location[1] + 20),
+            (0, 0, 255),
+            2,
+        )
+        # Save the image for debugging
+        cv.imwrite(f"./temp/error_page_{page + 1}_{location[0]}_{location[1]}.png", img)
+        return
 
     paper_links.append(link_address)
 
 
+def scroll(clicks):
+    # Scroll and wait for the result list to settle. The list may not move at
+    # all (already at the top), so only wait briefly for it to start moving.
+    region = results_region()
+    with mss() as sct:
+        before = grab_region(sct, region)
+    pyautogui.scroll(clicks)
+    with timed("scroll"):
+        if wait_for_change(region, before, timeout=SCROLL_START_TIMEOUT):
+            wait_for_stable(region)
+
+
 def process_a_page(template, page):
     # Scroll to the top of the page
-    pyautogui.scroll(1000)
-    time.sleep(1)  # Wait for the page to adjust
-    # Capture top half of the screen
-    img, monitor = capture_screen()
-    locations = detect_mark(img, template)
+    scroll(1000)
+    # Capture the result list
+    with timed("detect"):
+        img, monitor = capture_screen(gray=True)
+        locations, scale = detect_mark(img, template)
     # Process paper 1 - 6
     for location in locations[:6]:
-        process_mark_locations(location, monitor, page)
-        time.sleep(0.5)
+        process_mark_locations(location, monitor, page, scale)
     # Go to center
     pyautogui.moveTo(
         monitor["left"] + monitor["width"] / 2, monitor["top"] + monitor["height"] / 2
     )
-    time.sleep(1)
     # Scroll to the bottom of the page
-    pyautogui.scroll(-600)
-    time.sleep(1)  # Wait for the page to adjust
-    # Capture the bottom area of the screen
-    img, monitor = capture_screen()
-    # Process paper 7 - 10
-    locations = detect_mark(img, template)[-4:]
-    for location in locations:
-        process_mark_locations(location, monitor, page)
-        time.sleep(0.5)
+    scroll(-600)
+    # Capture the result list again
+    with timed("detect"):
+        img, monitor = capture_screen(gray=True)
+        # Process paper 7 - 10
+        locations, scale = detect_mark(img, template)
+    for location in locations[-4:]:
+        process_mark_locations(location, monitor, page, scale)
 
 
 def next_page():
     # Scroll down
-    pyautogui.scroll(-500)
-    time.sleep(1)  # Wait for the page to adjust
+    scroll(-500)
     with mss() as sct:
         monitor = sct.monitors[1]  # Capture the primary monitor
     pyautogui.moveTo(
         monitor["left"] + monitor["width"] / 2 - 410,
         monitor["top"] + monitor["height"] - 135,
     )
-    time.sleep(0.5)
+    region = results_region()
+    with mss() as sct:
+        before = grab_region(sct, region)
     pyautogui.click()
-    time.sleep(2)  # Wait for the page to load
+    # Wait for the next page to show up and finish loading
+    with timed("page load"):
+        if wait_for_change(region, before, timeout=3 * WAIT_TIMEOUT):
+            wait_for_stable(region)
 
 
 if __name__ == "__main__":
-    template = cv.imread("google_scholar_mark.png", cv.IMREAD_GRAYSCALE)
+    template = template_pyramid()
     with mss() as sct:
         monitor = sct.monitors[1]  # Capture the primary monitor
     # Go to center of the screen
     pyautogui.moveTo(
         monitor["left"] + monitor["width"] / 2, monitor["top"] + monitor["height"] / 2
     )
+    totals = Counter()
     for page in range(50):
-        process_a_page(template, page)
-        next_page()
+        timings.clear()
+        with timed("page"):
+            process_a_page(template, page)
+            next_page()
+        # Report where the time of each page goes
+        steps = ", ".join(
+            f"{step} {seconds:.1f}s"
+            for step, seconds in timings.most_common()
+            if step != "page"
+        )
+        print(f"Page {page + 1}: {timings['page']:.1f}s ({steps})")
+        totals.update(timings)
+    print(
+        "Total: "
+        + ", ".join(f"{step} {seconds:.1f}s" for step, seconds in totals.most_common())
+    )
     # Save the links to a file
     with open("paper_links.txt", "w+") as f:
         for link in paper_links:
@@ -0,0 +1,248 @@
+import json
+import zotero
+from doi import normalize_doi
+from itertools import batched
+from neo4j import Driver, ManagedTransaction
+from typing import Iterable
+
+# Rows sent per UNWIND query, each batch is one write transaction
+BATCH_SIZE = 1000
+# Uniqueness constraints also create the indexes that make MERGE fast
+CONSTRAINTS = [
+    "CREATE CONSTRAINT paper_doi IF NOT EXISTS FOR (p:Paper) REQUIRE p.doi IS UNIQUE",
+    "CREATE CONSTRAINT paper_id IF NOT EXISTS FOR (p:Paper) REQUIRE p.id IS UNIQUE",
+    "CREATE CONSTRAINT author_name IF NOT EXISTS "
+    "FOR (a:Author) REQUIRE a.name IS UNIQUE",
+    "CREATE CONSTRAINT journal_name IF NOT EXISTS "
+    "FOR (j:Journal) REQUIRE j.name IS UNIQUE",
+    "CREATE CONSTRAINT collection_id IF NOT EXISTS "
+    "FOR (c:Collection) REQUIRE c.id IS UNIQUE",
+]
+# Authors, journal and collections of the papers merged by the queries below
+PAPER_RELATIONSHIPS = """
+FOREACH (name IN row.authors |
+    MERGE (a:Author {name: name})
+    MERGE (a)-[:WROTE]->(p))
+FOREACH (journal IN CASE WHEN row.journal IS NULL THEN [] ELSE [row.journal] END |
+    MERGE (j:Journal {name: journal})
+    MERGE (p)-[:PUBLISH_IN]->(j))
+FOREACH (collection IN row.collections |
+    MERGE (c:Collection {id: collection})
+    MERGE (p)-[:IN_COLLECTION]->(c))
+"""
+# Papers without a Zotero item ID (WoS) are merged on their DOI
+PAPERS_BY_DOI_QUERY = (
+    """
+UNWIND $rows AS row
+MERGE (p:Paper {doi: row.doi})
+SET p += row.properties
+"""
+    + PAPER_RELATIONSHIPS
+)
+# Zotero items are merged on their ID, their DOI may be added or corrected later.
+# A paper loaded from WoS with the same DOI becomes the item's node, and the DOI
+# is only set when no other paper has it, so the constraints always hold.
+PAPERS_BY_ID_QUERY = (
+    """
+UNWIND $rows AS row
+OPTIONAL MATCH (loaded:Paper {doi: row.doi})
+WHERE loaded.id IS NULL AND NOT EXISTS { MATCH (:Paper {id: row.id}) }
+FOREACH (paper IN CASE WHEN loaded IS NULL THEN [] ELSE [loaded] END |
+    SET paper.id = row.id)
+WITH row
+MERGE (p:Paper {id: row.id})
+SET p += row.properties
+WITH p, row
+FOREACH (doi IN CASE
+    WHEN row.doi IS NULL OR EXISTS {
+        MATCH (other:Paper {doi: row.doi}) WHERE other.id IS NULL OR other.id <> row.id
+    } THEN [] ELSE [row.doi] END |
+    SET p.doi = doi)
+"""
+    + PAPER_RELATIONSHIPS
+)
+COLLECTIONS_QUERY = """
+UNWIND $rows AS row
+MERGE (c:Collection {id: row.id})
+SET c.name = row.name
+WITH c, row
+WHERE row.parent IS NOT NULL
+MERGE (parent:Collection {id: row.parent})
+MERGE (c)-[:SUBCOLLECTION_OF]->(parent)
+"""
+# Fields of `process_zotero.Paper` stored on Paper nodes when present
+LLM_FIELDS = ("is_agtech", "technology", "location", "participants")
+
+
+def create_constraints(driver: Driver):
+    for constraint in CONSTRAINTS:
+        driver.execute_query(constraint)
+
+
+def without_nulls(properties: dict) -> dict:
+    """
+    Leave out missing values, `SET p += ...` would otherwise remove properties
+    set from another source.
+    """
+    return {name: value for name, value in properties.items() if value is not None}
+
+
+def paper_row_from_item(item) -> dict:
+    """
+    Query parameters of a `ZoteroItem`, `ZoteroRecord` or `Paper`.
+    """
+    properties = {
+        "id": item.id,
+        "doi": normalize_doi(item.DOI),
+        "title": item.title,
+        "type": item.type,
+        "date": str(item.date) if item.date else None,
+        "url": item.url,
+        "abstract": item.abstract,
+    }
+    for name in LLM_FIELDS:
+        properties[name] = getattr(item, name, None) or None
+    return {
+        "properties": without_nulls(properties),
+        "authors": [
+            author["name"] if isinstance(author, dict) else author.name
+            for author in item.authors
+        ],
+        "journal": item.publication or None,
+        "collections": [key for key in item.collections.split(",") if key],
+    }
+
+
+def agtech_answer(value: str | None) -> str | None:
+    """
+    Yes/No of an is_agtech JSON answer, None for errors and unparsed answers.
+    """
+    try:
+        answer = json.loads(value or "")
+    except json.JSONDecodeError:
+        return None
+    if isinstance(answer, dict) and answer.get("is_agtech") in ("Yes", "No"):
+        return answer["is_agtech"]
+    return None
+
+
+def paper_row_from_zotero(row: dict) -> dict:
+    """
+    Query parameters of a row of the Zotero dataset written by `process_zotero`,
+    with the fields extracted by the LLM.
+    """
+    properties = {
+        "id": row["id"],
+        "doi": normalize_doi(row.get("DOI")),
+        "title": row.get("title"),
+        "type": row.get("type"),
+        "date": row.get("date") or None,
+        "url": row.get("url"),
+        "abstract": row.get("abstract"),
+        "is_agtech": agtech_answer(row.get("is_agtech")),
+    }
+    for name in ("technology", "location", "participants"):
+        properties[name] = row.get(name) or None
+    return {
+        "properties": without_nulls(properties),
+        "authors": row.get("authors") or [],
+        "journal": row.get("publication") or None,
+        "collections": [
+            key for key in (row.get("collections") or "").split(",") if key
+        ],
+    }
+
+
+def paper_row_from_wos(row: dict) -> dict:
+    """
+    Query parameters of a row of a WoS export, as processed by `process_export`.
+    """
+    agtech = row.get("agtech") or {}
+    properties = {
+        "doi": normalize_doi(row["DOI"]),
+        "title": row["Article Title"],
+        "type": row.get("Document Type"),
+        "date": row.get("Publication Date"),
+        "year": row.get("Publication Year"),
+        "abstract": row.get("Abstract"),
+        "is_agtech": agtech.get("is_agtech"),
+    }
+    return {
+        "properties": without_nulls(properties),
+        "authors": [
+            name.strip()
+            for name in (row.get("Authors") or "").split(";")
+            if name.strip()
+        ],
+        "journal": row.get("Source Title") or None,
+        "collections": [],
+    }
+
+
+def write_batch(tx: ManagedTransaction, query: str, rows: list[dict]):
+    tx.run(query, rows=rows).consume()
+
+
+def ingest_papers(
+    driver: Driver, rows: Iterable[dict], batch_size: int = BATCH_SIZE
+) -> int:
+    """
+    Upsert papers with their authors, journal and collections, `batch_size`
+    papers per write transaction. Zotero items are merged on their item ID and
+    other papers on their DOI, see `PAPERS_BY_ID_QUERY`. Managed transactions
+    are retried by the driver on transient errors. Return the number of papers
+    written.
+    """
+    count = 0
+    with driver.session() as session:
+        for batch in batched(rows, batch_size):
+            by_id = [
+                {
+                    **row,
+                    "id": row["properties"]["id"],
+                    "doi": row["properties"].get("doi"),
+                    "properties": {
+                        name: value
+                        for name, value in row["properties"].items()
+                        if name != "doi"
+                    },
+                }
+                for row in batch
+                if "id" in row["properties"]
+            ]
+            by_doi = [
+                {**row, "doi": row["properties"]["doi"]}
+                for row in batch
+                if "id" not in row["properties"] and "doi" in row["properties"]
+            ]
+            for query, keyed in (
+                (PAPERS_BY_ID_QUERY, by_id),
+                (PAPERS_BY_DOI_QUERY, by_doi),
+            ):
+                if keyed:
+                    session.execute_write(write_batch, query, keyed)
+                    count += len(keyed)
+    return count
+
+
+def ingest_collections(
+    driver: Driver,
+    collections: Iterable[zotero.ZoteroCollection],
+    batch_size: int = BATCH_SIZE,
+) -> int:
+    """
+    Upsert Zotero collections and their parent relationships.
+    """
+    rows = [
+        {
+            "id": collection.id,
+            "name": collection.name,
+            # Zotero gives False for top-level collections
+            "parent": collection.parent or None,
+        }
+        for collection in collections
+    ]
+    with driver.session() as session:
+        for batch in batched(rows, batch_size):
+            session.execute_write(write_batch, COLLECTIONS_QUERY, list(batch))
+    return len(rows)
@@ -0,0 +1,355 @@
+import asyncio
+import re
+import sqlite3
+import time
+import httpx
+import polars as pl
+from collections import defaultdict
+from doi import DOI_PATTERN, normalize_doi
+from lxml import etree, html
+from pathlib import Path
+from tqdm.asyncio import tqdm
+from typing import Iterable
+from urllib.parse import parse_qsl, unquote, urlencode, urlparse, urlunparse
+
+LINKS_PATH = Path("./paper_links.txt")
+INDEX_PATH = Path("./output") / "link_index.sqlite"
+RESOLVED_PATH = Path("./output") / "paper_links.csv"
+# Lookups in flight, overall and per publisher host
+MAX_CONCURRENCY = 16
+HOST_CONCURRENCY = 2
+LOOKUP_TIMEOUT = 30
+# Hosts that only redirect to the paper, with the query parameter holding its URL
+REDIRECT_PARAMS = {
+    "idp.springer.com": "redirect_uri",
+    "scholar.google.com": "url",
+    "www.google.com": "url",
+}
+# Tracking query parameters removed when normalizing a link, with the utm_* ones.
+# Other parameters are kept, they can be what identifies the paper (record.jsf?pid=).
+TRACKING_PARAMS = {"casa_token", "ved", "usg", "ei", "sa", "fbclid", "gclid"}
+# Hosts whose links are full of search parameters, only these ones are kept
+KEPT_PARAMS = {
+    "books.google.com": {"id"},
+    "papers.ssrn.com": {"abstract_id"},
+    "search.ebscohost.com": {"db", "AN"},
+}
+# Equivalent paths of the same paper on a host, rewritten to the first form
+CANONICAL_PATHS = [
+    ("sciencedirect.com", re.compile(r"/pii/(\w+)"), "/science/article/pii/{0}"),
+    ("ieeexplore.ieee.org", re.compile(r"/document/(\d+)"), "/document/{0}"),
+    ("researchgate.net", re.compile(r"/publication/(\d+)"), "/publication/{0}"),
+]
+# Publishers whose URLs hold a DOI in a form the generic pattern misses.
+# The first group of the pattern is formatted into the DOI template.
+DOI_RULES = [
+    # /chapters/edit/10.1201/9781003503934-6/<title slug>
+    ("taylorfrancis.com", re.compile(r"/(10\.\d{4,9}/[^/]+)"), "{0}"),
+    # /abstract/edcoll/9781839101731/9781839101731.00018.xml
+    ("elgaronline.com", re.compile(r"/(97[89]\d{10}\.\d+)\.xml"), "10.4337/{0}"),
+    ("nature.com", re.compile(r"/articles/([a-z]+[\d-]+)"), "10.1038/{0}"),
+    ("arxiv.org", re.compile(r"/(?:abs|pdf)/(\d{4}\.\d{4,5})"), "10.48550/arXiv.{0}"),
+]
+# Path segments found after the DOI in publisher URLs, e.g. /doi/10.1108/x/full/html
+TRAILING_SEGMENTS = {
+    "full",
+    "html",
+    "pdf",
+    "epdf",
+    "abstract",
+    "fulltext",
+    "summary",
+    "meta",
+}
+# Publishers whose DOIs have more than one slash (10.1088/1742-6596/2003/1/012008),
+# elsewhere a numeric segment after the DOI is an article number of the site
+MULTI_SEGMENT_DOI_HOSTS = ("iop.org",)
+# Meta tags giving the DOI of a landing page, names are compared in lowercase
+DOI_META_NAMES = ("citation_doi", "dc.identifier", "prism.doi")
+DOI_META_XPATH = "//meta[{}]/@content".format(
+    " or ".join(
+        f"translate(@name, 'ABCDEFGHIJKLMNOPQRSTUVWXYZ', 'abcdefghijklmnopqrstuvwxyz')"
+        f" = '{name}'"
+        for name in DOI_META_NAMES
+    )
+)
+# IEEE pages are rendered by JavaScript, the metadata is a JSON object
+IEEE_DOI_PATTERN = re.compile(r"\"doi\":\"(10\.\d{4,9}/[^\"]+)\"")
+
+
+def normalize_link(link: str) -> str | None:
+    """
+    Normalized form of a paper link, used to deduplicate links and as the key of
+    the index: redirect wrappers removed, lowercase host, no fragment, no
+    tracking parameters, no trailing slash. None for links that are not web
+    pages, such as `javascript:void(0)`.
+    """
+    url = urlparse(link.strip())
+    if url.scheme not in ("http", "https") or not url.netloc:
+        return None
+    host = url.netloc.lower()
+    if host in REDIRECT_PARAMS:
+        target = dict(parse_qsl(url.query)).get(REDIRECT_PARAMS[host])
+        return normalize_link(target) if target else None
+    path = url.path.rstrip("/") or "/"
+    for suffix, pattern, template in CANONICAL_PATHS:
+        if host.endswith(suffix) and (match := pattern.search(path)):
+            path = template.format(*match.groups())
+            break
+    params = parse_qsl(url.query, keep_blank_values=True)
+    if host in KEPT_PARAMS:
+        params = [(k, v) for k, v in params if k in KEPT_PARAMS[host]]
+    query = urlencode(
+        [(k, v) for k, v in params if not is_tracking_param(k)], safe=":/"
+    )
+    return urlunparse(("https", host, path, "", query, ""))
+
+
+def is_tracking_param(name: str) -> bool:
+    return name in TRACKING_PARAMS or name.startswith("utm_")
+
+
+def doi_from_link(link: str) -> str | None:
+    """
+    DOI contained in a link, from the publisher rules or the generic DOI pattern,
+    or None when the URL does not contain one (ScienceDirect PII, IEEE article
+    number, MDPI, ...). A query parameter holding a whole DOI
+    (`identifierValue=10.1201/...`) is used when the path has none.
+    """
+    url = urlparse(link)
+    host, path = url.netloc.lower(), unquote(url.path)
+    for suffix, pattern, template in DOI_RULES:
+        if host.endswith(suffix) and (match := pattern.search(path)):
+            return normalize_doi(template.format(*match.groups()))
+    if match := DOI_PATTERN.search(path):
+        return strip_trailing_segments(match.group(0), host)
+    for _, value in parse_qsl(url.query):
+        if DOI_PATTERN.fullmatch(value):
+            return strip_trailing_segments(value, host)
+    return None
+
+
+def strip_trailing_segments(doi: str, host: str) -> str | None:
+    """
+    Remove what publisher URLs add after a DOI: views such as /full/html or /meta,
+    and article numbers (/1310339) on hosts whose DOIs have a single slash.
+    """
+    numbered = not host.endswith(MULTI_SEGMENT_DOI_HOSTS)
+    segments = doi.removesuffix(".pdf").split("/")
+    while len(segments) > 2 and (
+        segments[-1].lower() in TRAILING_SEGMENTS
+        or (numbered and segments[-1].isdigit())
+    ):
+        segments.pop()
+    return normalize_doi("/".join(segments))
+
+
+def doi_from_page(page: bytes) -> str | None:
+    """
+    DOI given by the metadata of a landing page. The page is parsed from its
+    bytes, lxml refuses text starting with an XML declaration, and a page lxml
+    cannot parse at all gives no DOI.
+    """
+    try:
+        metadata = html.fromstring(page).xpath(DOI_META_XPATH)
+    except (ValueError, etree.ParserError):
+        metadata = []
+    for content in metadata:
+        if doi := normalize_doi(content):
+            return doi
+    if match := IEEE_DOI_PATTERN.search(page.decode("utf-8", "replace")):
+        return normalize_doi(match.group(1))
+    return None
+
+
+class LinkIndex:
+    """
+    Persistent SQLite index of normalized links to their DOI.
+    Every resolved link is kept, including the ones without a DOI, with how it was
+    resolved (`rule` or `lookup`), so a link is only ever looked up once.
+    """
+
+    def __init__(self, path: Path = INDEX_PATH):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(self.path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        with self.db:
+            self.db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS links (
+                    url TEXT PRIMARY KEY,
+                    doi TEXT,
+                    method TEXT NOT NULL,
+                    resolved REAL NOT NULL
+                )
+                """
+            )
+            self.db.execute("CREATE INDEX IF NOT EXISTS links_doi ON links (doi)")
+
+    def get(self, url: str) -> str | None:
+        """
+        DOI of an indexed link, None if it has none or is not indexed.
+        """
+        row = self.db.execute("SELECT doi FROM links WHERE url = ?", (url,)).fetchone()
+        return row[0] if row else None
+
+    def __contains__(self, url) -> bool:
+        return (
+            self.db.execute("SELECT 1 FROM links WHERE url = ?", (url,)).fetchone()
+            is not None
+        )
+
+    def __len__(self) -> int:
+        return self.db.execute("SELECT COUNT(*) FROM links").fetchone()[0]
+
+    def missing(self, urls: Iterable[str], retry_unresolved: bool = False) -> list[str]:
+        """
+        Links that are not indexed yet. With `retry_unresolved`, links looked up
+        before without finding a DOI are included as well.
+        """
+        condition = "doi IS NOT NULL" if retry_unresolved else "1"
+        indexed = {
+            row[0]
+            for row in self.db.execute(f"SELECT url FROM links WHERE {condition}")
+        }
+        return [url for url in urls if url not in indexed]
+
+    def put(self, url: str, doi: str | None, method: str):
+        self.put_many([(url, doi)], method)
+
+    def put_many(self, rows: Iterable[tuple[str, str | None]], method: str):
+        now = time.time()
+        with self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO links VALUES (?, ?, ?, ?)",
+                ((url, doi, method, now) for url, doi in rows),
+            )
+
+    def frame(self) -> pl.DataFrame:
+        """
+        The whole index as a DataFrame with columns url, doi, method and resolved.
+        """
+        return pl.DataFrame(
+            self.db.execute("SELECT url, doi, method, resolved FROM links").fetchall(),
+            schema={
+                "url": pl.Utf8,
+                "doi": pl.Utf8,
+                "method": pl.Utf8,
+                "resolved": pl.Float64,
+            },
+            orient="row",
+        )
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def read_links(path: Path = LINKS_PATH) -> list[str]:
+    """
+    Normalized links of `paper_links.txt`, deduplicated in file order.
+    """
+    with path.open("r") as fp:
+        links = (normalize_link(line) for line in fp if line.strip())
+        return list(dict.fromkeys(link for link in links if link))
+
+
+def create_lookup_client(max_connections: int = MAX_CONCURRENCY) -> httpx.AsyncClient:
+    """
+    Pooled client following redirects, like a browser opening the link.
+    """
+    return httpx.AsyncClient(
+        headers={"User-Agent": "Mozilla/5.0"},
+        limits=httpx.Limits(max_connections=max_connections),
+        follow_redirects=True,
+        timeout=LOOKUP_TIMEOUT,
+    )
+
+
+async def lookup_doi(client: httpx.AsyncClient, url: str) -> str | None:
+    """
+    Open a link and find the DOI of the page it ends on: in the final URL after
+    redirects (e.g. ScienceDirect to linkinghub or doi.org), else in the page
+    metadata.
+    """
+    response = await client.get(url)
+    response.raise_for_status()
+    return doi_from_link(str(response.url)) or doi_from_page(response.content)
+
+
+async def lookup_links(
+    urls: list[str],
+    index: LinkIndex,
+    max_concurrency: int = MAX_CONCURRENCY,
+    host_concurrency: int = HOST_CONCURRENCY,
+) -> list[tuple[str, Exception]]:
+    """
+    Look up links concurrently and add them to the index as they are resolved.
+    At most `max_concurrency` lookups are in flight, and `host_concurrency` per
+    host, so a publisher is not hit by all of them at once.
+    Links failing with a network or HTTP error are not indexed, they are returned
+    with their error and will be looked up again by the next run.
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+    hosts = defaultdict(lambda: asyncio.Semaphore(host_concurrency))
+    errors = []
+
+    async def lookup(client: httpx.AsyncClient, url: str):
+        async with hosts[urlparse(url).netloc], semaphore:
+            try:
+                doi = await lookup_doi(client, url)
+            except httpx.HTTPError as e:
+                errors.append((url, e))
+                return
+        index.put(url, doi, "lookup")
+
+    async with create_lookup_client(max_concurrency) as client:
+        await tqdm.gather(*(lookup(client, url) for url in urls), desc="Lookups")
+    return errors
+
+
+def resolve_links(
+    links: list[str],
+    index: LinkIndex,
+    lookup: bool = True,
+    retry_unresolved: bool = False,
+) -> pl.DataFrame:
+    """
+    Resolve normalized links to DOIs. Every link goes through the URL rules, which
+    are cheap, so links indexed by an older version of the rules are fixed. The
+    ones the rules cannot resolve are looked up over the network when they are
+    not indexed yet (`lookup=False` skips that step).
+    Return a DataFrame with columns url and doi, in the order of `links`.
+    """
+    by_rule = [(url, doi_from_link(url)) for url in links]
+    index.put_many([(url, doi) for url, doi in by_rule if doi], "rule")
+    unresolved = index.missing(
+        [url for url, doi in by_rule if not doi], retry_unresolved
+    )
+    if lookup and unresolved:
+        errors = asyncio.run(lookup_links(unresolved, index))
+        for url, error in errors:
+            print(f"Lookup failed for {url}: {type(error).__name__}")
+    return pl.DataFrame(
+        {"url": links, "doi": [index.get(url) for url in links]},
+        schema={"url": pl.Utf8, "doi": pl.Utf8},
+    )
+
+
+if __name__ == "__main__":
+    links = read_links()
+    with LinkIndex() as index:
+        resolved = resolve_links(links, index)
+    RESOLVED_PATH.parent.mkdir(parents=True, exist_ok=True)
+    resolved.write_csv(RESOLVED_PATH)
+    with_doi = resolved.filter(pl.col("doi").is_not_null())
+    print(
+        f"{len(links)} unique links, {len(with_doi)} with a DOI, "
+        f"{with_doi['doi'].n_unique()} unique DOIs"
+    )
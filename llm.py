@@ -1,5 +1,34 @@
+import asyncio
+import contextlib
+import hashlib
+import importlib.util
+import random
+import time
 import httpx
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable
 from dotenv import dotenv_values
+from tqdm.asyncio import tqdm
+from llm_cache import CACHE_PATH, LLMCache, make_key
+from response_parser import (
+    RETRY_INSTRUCTION,
+    AbstractExtraction,
+    BatchAnswer,
+    IsAgtechAnswer,
+    LocationAnswer,
+    ParseError,
+    ParticipantsAnswer,
+    TechnologyAnswer,
+    parse,
+    parse_items,
+    parse_text,
+)
+
+GENAI_URL = "https://genai.rcac.purdue.edu/api/chat/completions"
+GENAI_MODEL = "llama4:latest"
+# Rough upper bound on the size of one batched request, see `is_agtech_batch`
+BATCH_TOKEN_BUDGET = 6000
 
 
 def read_api_key() -> str:
@@ -10,15 +39,447 @@ def read_api_key() -> str:
     return api_key
 
 
-async def send_request(prompt: str) -> httpx.Response:
-    api_key = read_api_key()
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json",
-    }
+class LLMClient:
+    """
+    Long-lived HTTP client for the GenAI endpoint.
+    Connections are kept alive and pooled between requests, HTTP/2 is negotiated
+    when the `h2` package is installed and the server supports it, and the API key
+    is read from `.env` only once.
+    """
+
+    def __init__(
+        self,
+        api_key: str | None = None,
+        max_connections: int = 32,
+        max_keepalive_connections: int = 16,
+        keepalive_expiry: float = 60,
+        http2: bool = True,
+        timeout: float = 300,
+    ):
+        self.api_key = api_key or read_api_key()
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        # HTTP/2 support in httpx is optional and needs the `h2` package
+        self.http2 = http2 and importlib.util.find_spec("h2") is not None
+        self.timeout = timeout
+        self._client: httpx.AsyncClient | None = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """
+        The underlying `httpx.AsyncClient`, created on first use.
+        """
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                headers={
+                    "Authorization": f"Bearer {self.api_key}",
+                    "Content-Type": "application/json",
+                },
+                limits=self.limits,
+                http2=self.http2,
+                timeout=self.timeout,
+            )
+        return self._client
+
+    async def post(self, body: dict, timeout: float | None = None) -> httpx.Response:
+        return await self.client.post(
+            url=GENAI_URL,
+            json=body,
+            timeout=timeout if timeout is not None else httpx.USE_CLIENT_DEFAULT,
+        )
+
+    async def aclose(self):
+        """
+        Close all pooled connections.
+        """
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+
+_client: LLMClient | None = None
+
+
+def configure_client(**kwargs) -> LLMClient:
+    """
+    Replace the shared client with one built from the given options,
+    e.g. `configure_client(max_connections=64, http2=False)`.
+    Call it before any request is sent, the previous client is not closed.
+    """
+    global _client
+    _client = LLMClient(**kwargs)
+    return _client
+
+
+def get_client() -> LLMClient:
+    """
+    Return the shared client, creating it with default options on first use.
+    """
+    global _client
+    if _client is None:
+        _client = LLMClient()
+    return _client
+
+
+async def close_client():
+    """
+    Shutdown hook: close the shared client's connections.
+    Must be awaited in the same event loop that sent the requests,
+    the client reconnects if it is used again afterwards.
+    """
+    if _client is not None:
+        await _client.aclose()
+
+
+class TokenBucket:
+    """
+    Token bucket allowing `rate` requests per second on average
+    with bursts of up to `burst` requests.
+    """
+
+    def __init__(self, rate: float, burst: int | None = None):
+        self.rate = rate
+        self.capacity = burst or max(1, int(rate))
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class Scheduler:
+    """
+    Bounded-concurrency scheduler for requests to the GenAI endpoint.
+    At most `max_in_flight` requests run at once and, if `requests_per_second` is
+    set, new requests are paced by a token bucket.
+    The in-flight limit adapts AIMD-style: it grows by about one per round-trip
+    while requests succeed quickly, and is cut by `decrease_factor` on 429/5xx
+    responses, transport errors or latency above `latency_target`.
+    A 429 or 503 also pauses new requests for `Retry-After` (or `backoff`) seconds.
+    """
+
+    def __init__(
+        self,
+        max_in_flight: int = 16,
+        min_in_flight: int = 1,
+        requests_per_second: float | None = 4.0,
+        burst: int | None = None,
+        latency_target: float = 60.0,
+        decrease_factor: float = 0.5,
+        backoff: float = 5.0,
+    ):
+        self.max_in_flight = max_in_flight
+        self.min_in_flight = min_in_flight
+        self.requests_per_second = requests_per_second
+        self.burst = burst
+        self.latency_target = latency_target
+        self.decrease_factor = decrease_factor
+        self.backoff = backoff
+        self.limit = float(max_in_flight)
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self._last_decrease = 0.0
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+    def _bind(self):
+        # asyncio primitives belong to one event loop, recreate them for each
+        # `asyncio.run` so the shared scheduler can be reused across runs
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._loop = loop
+            self._condition = asyncio.Condition()
+            self._bucket = (
+                TokenBucket(self.requests_per_second, self.burst)
+                if self.requests_per_second
+                else None
+            )
+            self.in_flight = 0
+
+    @contextlib.asynccontextmanager
+    async def slot(self):
+        """
+        Wait for a free slot (and a token) before sending a request.
+        """
+        self._bind()
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+        try:
+            if (delay := self.paused_until - time.monotonic()) > 0:
+                await asyncio.sleep(delay)
+            if self._bucket:
+                await self._bucket.acquire()
+            yield
+        finally:
+            async with self._condition:
+                self.in_flight -= 1
+                self._condition.notify_all()
+
+    def record(self, started: float, response: httpx.Response | None):
+        """
+        Adjust the in-flight limit from the outcome of a request started at
+        `started` (`time.monotonic()`). `response` is None if the request failed.
+        """
+        now = time.monotonic()
+        status = response.status_code if response is not None else None
+        if status is None or status == 429 or status >= 500:
+            overloaded = True
+        else:
+            overloaded = now - started > self.latency_target
+
+        if not overloaded:
+            self.limit = min(self.max_in_flight, self.limit + 1 / self.limit)
+            return
+        # Only cut once per round-trip: requests started before the last cut
+        # were sent under the old limit and say nothing new about the endpoint
+        if started > self._last_decrease:
+            self.limit = max(self.min_in_flight, self.limit * self.decrease_factor)
+            self._last_decrease = now
+        if status in (429, 503):
+            try:
+                delay = float(response.headers.get("Retry-After", self.backoff))
+            except ValueError:
+                delay = self.backoff
+            self.paused_until = max(self.paused_until, now + delay)
+
+
+_scheduler: Scheduler | None = None
+
+
+def configure_scheduler(**kwargs) -> Scheduler:
+    """
+    Replace the shared scheduler with one built from the given options,
+    e.g. `configure_scheduler(max_in_flight=8, requests_per_second=2)`.
+    """
+    global _scheduler
+    _scheduler = Scheduler(**kwargs)
+    return _scheduler
+
+
+def get_scheduler() -> Scheduler:
+    """
+    Return the shared scheduler, creating it with default options on first use.
+    """
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = Scheduler()
+    return _scheduler
+
+
+_cache: LLMCache | None = None
+_cache_configured = False
+
+
+def configure_cache(path: Path | None = CACHE_PATH, **kwargs) -> LLMCache | None:
+    """
+    Replace the shared response cache, e.g. `configure_cache(read_only=True)`
+    or `configure_cache(ttl=30 * 24 * 3600, max_entries=100_000)`.
+    Pass `path=None` to disable caching.
+    """
+    global _cache, _cache_configured
+    if _cache is not None:
+        _cache.close()
+    _cache = LLMCache(path, **kwargs) if path is not None else None
+    _cache_configured = True
+    return _cache
+
+
+def get_cache() -> LLMCache | None:
+    """
+    Return the shared response cache, opening the default one on first use.
+    """
+    if not _cache_configured:
+        configure_cache()
+    return _cache
+
+
+class RetryPolicy:
+    """
+    Retry and deadline settings for `send_request`.
+    A request is attempted up to `attempts` times, waiting a jittered exponential
+    backoff (`base_delay` doubling up to `max_delay`) between attempts.
+    Each attempt times out after `attempt_timeout` seconds, all attempts of one
+    request must finish within `call_budget` seconds and, if `deadline` is set,
+    no request is attempted more than `deadline` seconds after the policy was made.
+    """
+
+    def __init__(
+        self,
+        attempts: int = 5,
+        base_delay: float = 2.0,
+        max_delay: float = 60.0,
+        attempt_timeout: float = 300.0,
+        call_budget: float | None = 900.0,
+        deadline: float | None = None,
+    ):
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.attempt_timeout = attempt_timeout
+        self.call_budget = call_budget
+        self.deadline_at = time.monotonic() + deadline if deadline else None
+
+    def backoff(self, attempt: int) -> float:
+        """
+        "Full jitter" delay before the given retry (1 for the first retry).
+        """
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+
+    def call_deadline(self) -> float | None:
+        """
+        Monotonic time by which a request starting now has to be finished.
+        """
+        deadlines = [self.deadline_at]
+        if self.call_budget:
+            deadlines.append(time.monotonic() + self.call_budget)
+        return min((d for d in deadlines if d is not None), default=None)
+
+
+class CircuitBreaker:
+    """
+    Stop sending requests to a degraded endpoint.
+    After `failure_threshold` consecutive failed requests the circuit opens and
+    requests are refused for `reset_timeout` seconds. Then a single trial request
+    is let through: success closes the circuit, failure opens it again.
+    """
+
+    def __init__(self, failure_threshold: int = 20, reset_timeout: float = 60.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: float | None = None
+        self._trial = False
+
+    def allow(self) -> bool:
+        if self.opened_at is None:
+            return True
+        if time.monotonic() - self.opened_at < self.reset_timeout or self._trial:
+            return False
+        self._trial = True
+        return True
+
+    def end_trial(self):
+        """
+        Let another trial request through, e.g. when the trial was cancelled.
+        """
+        self._trial = False
+
+    def record(self, success: bool):
+        self._trial = False
+        if success:
+            self.failures = 0
+            self.opened_at = None
+        else:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+
+_retry_policy: RetryPolicy | None = None
+_circuit_breaker: CircuitBreaker | None = None
+
+
+def configure_retries(**kwargs) -> RetryPolicy:
+    """
+    Replace the shared retry policy, e.g. `configure_retries(attempts=3, deadline=3600)`.
+    """
+    global _retry_policy
+    _retry_policy = RetryPolicy(**kwargs)
+    return _retry_policy
+
+
+def get_retry_policy() -> RetryPolicy:
+    global _retry_policy
+    if _retry_policy is None:
+        _retry_policy = RetryPolicy()
+    return _retry_policy
+
+
+def configure_circuit_breaker(**kwargs) -> CircuitBreaker:
+    """
+    Replace the shared circuit breaker, e.g. `configure_circuit_breaker(reset_timeout=120)`.
+    """
+    global _circuit_breaker
+    _circuit_breaker = CircuitBreaker(**kwargs)
+    return _circuit_breaker
+
+
+def get_circuit_breaker() -> CircuitBreaker:
+    global _circuit_breaker
+    if _circuit_breaker is None:
+        _circuit_breaker = CircuitBreaker()
+    return _circuit_breaker
+
+
+@dataclass
+class ItemError:
+    """
+    Failure of one coroutine passed to `gather`, `index` is its input position.
+    """
+
+    index: int
+    error: Exception
+
+    def __str__(self):
+        return f"{type(self.error).__name__}: {self.error}"
+
+
+async def gather(tasks, desc: str | None = None) -> tuple[list, list[ItemError]]:
+    """
+    Run coroutines concurrently with a tqdm progress bar.
+    Results are returned in input order. The requests sent by the coroutines are
+    throttled by the shared scheduler, so it is safe to pass thousands at once.
+    A failing coroutine does not stop the others: its result is None and its
+    exception is reported in the returned list of errors.
+    """
+    errors: list[ItemError] = []
+
+    async def guarded(index, task):
+        try:
+            return await task
+        except Exception as e:
+            errors.append(ItemError(index, e))
+            return None
+
+    results = await tqdm.gather(
+        *(guarded(index, task) for index, task in enumerate(tasks)), desc=desc
+    )
+    errors.sort(key=lambda error: error.index)
+    return results, errors
+
 
+# Status codes worth retrying, anything else is returned to the caller as is
+RETRY_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+
+async def send_request(prompt: str) -> httpx.Response:
+    """
+    Send a prompt to the GenAI endpoint, retrying timeouts, transport errors and
+    retryable status codes according to the shared `RetryPolicy`.
+    Raise RuntimeError when all attempts failed or the deadline is reached.
+    """
     body = {
-        "model": "llama4:latest",
+        "model": GENAI_MODEL,
         "messages": [
             {
                 "role": "user",
@@ -27,25 +488,65 @@ async def send_request(prompt: str) -> httpx.Response:
         ],
     }
 
-    try:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                url="https://genai.rcac.purdue.edu/api/chat/completions",
-                headers=headers,
-                json=body,
-                timeout=300,
-            )
-        return response
+    policy = get_retry_policy()
+    breaker = get_circuit_breaker()
+    scheduler = get_scheduler()
+    deadline = policy.call_deadline()
+    error = RuntimeError("No request attempted")
+    for attempt in range(policy.attempts):
+        if attempt:
+            delay = policy.backoff(attempt)
+            if deadline is not None and time.monotonic() + delay >= deadline:
+                raise RuntimeError(
+                    f"Deadline exceeded after {attempt} attempts: {error}"
+                )
+            await asyncio.sleep(delay)
+        # The circuit is checked once a slot is free, so requests queued in the
+        # scheduler while the circuit opened are not sent anyway
+        async with scheduler.slot():
+            if not breaker.allow():
+                error = RuntimeError("Circuit open: the endpoint keeps failing")
+                continue
+            trial = breaker.opened_at is not None
+            timeout = policy.attempt_timeout
+            if deadline is not None:
+                timeout = min(timeout, max(deadline - time.monotonic(), 0.001))
+            started = time.monotonic()
+            try:
+                response = await get_client().post(body, timeout=timeout)
 
-    except httpx.TimeoutException as e:
-        raise RuntimeError(f"Request timed out: {e}") from e
+            except httpx.TimeoutException as e:
+                scheduler.record(started, None)
+                breaker.record(False)
+                error = RuntimeError(f"Request timed out: {e}")
+                continue
 
-    except httpx.RequestError as e:
-        raise RuntimeError(f"An error occurred while requesting: {e}") from e
+            except httpx.RequestError as e:
+                scheduler.record(started, None)
+                breaker.record(False)
+                error = RuntimeError(f"An error occurred while requesting: {e}")
+                continue
 
+            else:
+                scheduler.record(started, response)
+                if response.status_code in RETRY_STATUS_CODES:
+                    breaker.record(False)
+                    error = RuntimeError(
+                        f"Error: {response.status_code}, {response.text}"
+                    )
+                    continue
+                breaker.record(True)
+                return response
 
-async def is_agtech_abstract(abstract_text: str) -> str:
-    prompt = f"""
+            finally:
+                # A cancelled trial request must not keep the circuit open forever
+                if trial:
+                    breaker.end_trial()
+
+    raise error
+
+
+IS_AGTECH_PROMPT = """
     From the abstract I am going to give to you, can you tell me if the abstract is talking about agricultural technology or not? 
     Abstract: {abstract_text}
     Format the output in JSON format with the following structure. Do not provide any thing else, just answer in the following format:
@@ -57,15 +558,7 @@ async def is_agtech_abstract(abstract_text: str) -> str:
     
     """
 
-    response = await send_request(prompt)
-    if response.status_code == 200:
-        return response.json()["choices"][0]["message"]["content"].strip()
-    else:
-        raise RuntimeError(f"Error: {response.status_code}, {response.text}")
-
-
-async def technology_from_abstract(abstract_text: str) -> str:
-    prompt = f"""
+TECHNOLOGY_PROMPT = """
     From the abstract I am going to give to you, can you tell me what agricultural technologies are mentioned in the abstract? 
     If no agricultural technology is mentioned, just answer "No agricultural technology mentioned".
     If agricultural technologies are mentioned, mention them in a comma-separated list followed by the sentence that mentions them.
@@ -73,15 +566,7 @@ async def technology_from_abstract(abstract_text: str) -> str:
     Abstract: {abstract_text}
     """
 
-    response = await send_request(prompt)
-    if response.status_code == 200:
-        return response.json()["choices"][0]["message"]["content"].strip()
-    else:
-        raise RuntimeError(f"Error: {response.status_code}, {response.text}")
-
-
-async def location_from_abstract(abstract_text: str) -> str:
-    prompt = f"""
+LOCATION_PROMPT = """
     From the abstract I am going to give to you, can you tell me the geographical location mentioned in the abstract? 
     If no location is mentioned, just answer "No location mentioned".
     If locations are mentioned, mention them in a comma-separated list followed by the sentence that mentions them.
@@ -89,15 +574,7 @@ async def location_from_abstract(abstract_text: str) -> str:
     Abstract: {abstract_text}
     """
 
-    response = await send_request(prompt)
-    if response.status_code == 200:
-        return response.json()["choices"][0]["message"]["content"].strip()
-    else:
-        raise RuntimeError(f"Error: {response.status_code}, {response.text}")
-
-
-async def participants_from_abstract(abstract_text: str) -> str:
-    prompt = f"""
+PARTICIPANTS_PROMPT = """
     From the abstract I am going to give to you, can you tell me the types of participants mentioned in the abstract? 
     If no participants are mentioned, just answer "No participants mentioned".
     If participants are mentioned, mention them in a comma-separated list followed by the sentence that mentions them.
@@ -105,8 +582,259 @@ async def participants_from_abstract(abstract_text: str) -> str:
     Abstract: {abstract_text}
     """
 
+
+EXTRACTION_PROMPT = """
+    From the abstract I am going to give to you, answer the following questions:
+    1. Is the abstract talking about agricultural technology or not?
+    2. What agricultural technologies are mentioned in the abstract?
+    3. What geographical locations are mentioned in the abstract?
+    4. What types of participants are mentioned in the abstract?
+    Abstract: {abstract_text}
+    Format the output in JSON format with the following structure. Do not provide any thing else, just answer in the following format:
+    {{
+        "is_agtech": "Yes or No",
+        "sentence": "The sentence in the abstract that indicates whether it's AgTech or not. if multiple sentences indicate that, just provide the best one",
+        "reason": "A brief explanation of why you think it's AgTech or not based on the abstract.",
+        "technology": "Comma-separated list of agricultural technologies followed by the sentence that mentions them, or No agricultural technology mentioned",
+        "location": "Comma-separated list of locations followed by the sentence that mentions them, or No location mentioned",
+        "participants": "Comma-separated list of participant types followed by the sentence that mentions them, or No participants mentioned"
+    }}
+    """
+
+
+BATCH_PROMPT = """
+    I am going to give you several abstracts, each one starts with its ID in square brackets.
+    For each abstract, can you tell me if the abstract is talking about agricultural technology or not?
+    Abstracts:
+    {abstract_text}
+    Format the output as a JSON list with one object per abstract with the following structure. Do not provide any thing else, just answer in the following format:
+    [
+        {{
+            "id": "The ID of the abstract, without square brackets",
+            "is_agtech": "Yes or No",
+            "sentence": "The sentence in the abstract that indicates whether it's AgTech or not. if multiple sentences indicate that, just provide the best one",
+            "reason": "A brief explanation of why you think it's AgTech or not based on the abstract."
+        }}
+    ]
+    """
+
+
+async def complete(prompt: str) -> str:
+    """
+    Send a prompt and return the content of the reply.
+    """
     response = await send_request(prompt)
     if response.status_code == 200:
         return response.json()["choices"][0]["message"]["content"].strip()
     else:
         raise RuntimeError(f"Error: {response.status_code}, {response.text}")
+
+
+async def ask(template: str, abstract_text: str) -> str:
+    """
+    Fill a prompt template with an abstract and return the reply,
+    answering from the shared cache when the same question was asked before.
+    """
+    cache = get_cache()
+    key = make_key(GENAI_MODEL, template, abstract_text)
+    if cache is not None and (content := cache.get(key)) is not None:
+        return content
+    content = await complete(template.format(abstract_text=abstract_text))
+    if cache is not None:
+        cache.put(key, content)
+    return content
+
+
+async def is_agtech_abstract(abstract_text: str) -> str:
+    return await ask(IS_AGTECH_PROMPT, abstract_text)
+
+
+async def technology_from_abstract(abstract_text: str) -> str:
+    return await ask(TECHNOLOGY_PROMPT, abstract_text)
+
+
+async def location_from_abstract(abstract_text: str) -> str:
+    return await ask(LOCATION_PROMPT, abstract_text)
+
+
+async def participants_from_abstract(abstract_text: str) -> str:
+    return await ask(PARTICIPANTS_PROMPT, abstract_text)
+
+
+async def ask_again(template: str, abstract_text: str) -> str:
+    """
+    Ask again a question whose answer could not be parsed, insisting on a JSON
+    answer. The retry prompt has its own cache entries.
+    """
+    return await ask(template + RETRY_INSTRUCTION, abstract_text)
+
+
+async def extract_fields(abstract_text: str) -> dict[str, str]:
+    """
+    Extract is_agtech, technology, location and participants from an abstract
+    with a single request.
+    If the reply does not validate against `AbstractExtraction`, fall back to
+    asking each question separately.
+    is_agtech is returned as JSON with the same keys as `is_agtech_abstract` asks for
+    (or the raw answer if even that does not parse).
+    """
+    content = await ask(EXTRACTION_PROMPT, abstract_text)
+    try:
+        extraction = parse(AbstractExtraction, content)
+        return {
+            "is_agtech": extraction.model_dump_json(
+                include={"is_agtech", "sentence", "reason"}
+            ),
+            "technology": extraction.technology,
+            "location": extraction.location,
+            "participants": extraction.participants,
+        }
+
+    except ParseError:
+        is_agtech = await is_agtech_abstract(abstract_text)
+        try:
+            is_agtech = parse(IsAgtechAnswer, is_agtech).model_dump_json()
+        except ParseError:
+            pass
+        return {
+            "is_agtech": is_agtech,
+            "technology": parse_text(
+                TechnologyAnswer, await technology_from_abstract(abstract_text)
+            ).technology,
+            "location": parse_text(
+                LocationAnswer, await location_from_abstract(abstract_text)
+            ).location,
+            "participants": parse_text(
+                ParticipantsAnswer, await participants_from_abstract(abstract_text)
+            ).participants,
+        }
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Cheap token estimate, about four characters per token for English text.
+    """
+    return len(text) // 4 + 1
+
+
+def abstract_id(abstract_text: str) -> str:
+    """
+    Stable ID of an abstract, used to deduplicate the abstracts of a batch run.
+    The model sees short positional IDs instead, see `_is_agtech_batch`.
+    """
+    return hashlib.sha1(abstract_text.encode()).hexdigest()
+
+
+def pack_batches(
+    abstracts: dict[str, str], token_budget: int = BATCH_TOKEN_BUDGET
+) -> list[dict[str, str]]:
+    """
+    Greedily pack abstracts (by ID) into batches whose prompt stays under the token
+    budget. An abstract larger than the budget gets a batch of its own.
+    """
+    budget = token_budget - estimate_tokens(BATCH_PROMPT)
+    batches: list[dict[str, str]] = []
+    batch: dict[str, str] = {}
+    used = 0
+    for id, text in abstracts.items():
+        tokens = estimate_tokens(text) + 4
+        if batch and used + tokens > budget:
+            batches.append(batch)
+            batch, used = {}, 0
+        batch[id] = text
+        used += tokens
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+async def _is_agtech_batch(batch: dict[str, str]) -> dict[str, str]:
+    """
+    Send one batch and split the reply back out per abstract ID.
+    The abstracts are numbered from 0 in the prompt, short IDs that cannot
+    collide within a batch, and the numbers are mapped back to the batch IDs.
+    Items missing from or malformed in the reply are left out.
+    """
+    ids = list(batch)
+    block = "\n".join(
+        f"[{number}] {text}" for number, text in enumerate(batch.values())
+    )
+    content = await complete(BATCH_PROMPT.format(abstract_text=block))
+    try:
+        items, _ = parse_items(BatchAnswer, content)
+    except ParseError:
+        return {}
+
+    answers = {}
+    for answer in items:
+        number = answer.id.strip("[] ")
+        if number.isdigit() and int(number) < len(ids):
+            answers[ids[int(number)]] = answer.model_dump_json(exclude={"id"})
+    return answers
+
+
+async def is_agtech_batch(
+    abstracts: list[str],
+    token_budget: int = BATCH_TOKEN_BUDGET,
+    on_result: Callable[[int, str], None] | None = None,
+) -> tuple[list[str | None], list[ItemError]]:
+    """
+    Batched version of `is_agtech_abstract`: pack several abstracts into each
+    request under `token_budget`, then demultiplex the reply by abstract ID.
+    Answers are returned in input order, in the same JSON shape as
+    `is_agtech_abstract`. Abstracts missing from or malformed in a batch reply are
+    retried one by one. Answers are cached per abstract, not per batch.
+    Like `gather`, abstracts that still fail are None and reported as errors.
+    `on_result(index, answer)` is called for every abstract as soon as its answer
+    is available.
+    """
+    cache = get_cache()
+    ids = [abstract_id(abstract) for abstract in abstracts]
+    positions: dict[str, list[int]] = {}
+    for index, id in enumerate(ids):
+        positions.setdefault(id, []).append(index)
+    results: dict[str, str] = {}
+
+    def deliver(id: str, content: str):
+        results[id] = content
+        if on_result is not None:
+            for index in positions[id]:
+                on_result(index, content)
+
+    pending: dict[str, str] = {}
+    for id, abstract in zip(ids, abstracts):
+        if id in results or id in pending:
+            continue
+        key = make_key(GENAI_MODEL, BATCH_PROMPT, abstract)
+        if cache is not None and (content := cache.get(key)) is not None:
+            deliver(id, content)
+        else:
+            pending[id] = abstract
+
+    async def run_batch(batch: dict[str, str]):
+        for id, content in (await _is_agtech_batch(batch)).items():
+            deliver(id, content)
+            if cache is not None:
+                cache.put(make_key(GENAI_MODEL, BATCH_PROMPT, pending[id]), content)
+
+    async def run_single(id: str):
+        content = await is_agtech_abstract(pending[id])
+        deliver(id, content)
+        # Also cache it as a batch answer, or the next run would batch it again
+        if cache is not None:
+            cache.put(make_key(GENAI_MODEL, BATCH_PROMPT, pending[id]), content)
+
+    batches = pack_batches(pending, token_budget)
+    # A failed batch is not fatal, its abstracts are retried one by one below
+    await gather([run_batch(batch) for batch in batches], "Batches")
+
+    retry = [id for id in pending if id not in results]
+    failed: dict[str, Exception] = {}
+    if retry:
+        _, retry_errors = await gather([run_single(id) for id in retry], "Retries")
+        failed = {retry[error.index]: error.error for error in retry_errors}
+
+    errors = [
+        ItemError(index, failed[id]) for index, id in enumerate(ids) if id in failed
+    ]
+    return [results.get(id) for id in ids], errors
@@ -0,0 +1,187 @@
+import hashlib
+import json
+import sqlite3
+import time
+from dataclasses import dataclass
+from pathlib import Path
+
+CACHE_PATH = Path("./output") / "llm_cache.sqlite"
+# The cache is trimmed when the writes since the last eviction exceed this
+# fraction of `max_entries` (at least every write for small caches), so it never
+# holds more than that many extra entries
+EVICT_FRACTION = 0.01
+# Access times of hits are written in batches of this size instead of one
+# commit per hit, and before evicting and closing
+ACCESS_BATCH = 1000
+
+
+def template_version(template: str) -> str:
+    """
+    Short hash identifying a prompt template.
+    Editing a template changes its version, so old answers are not reused for it.
+    """
+    return hashlib.sha256(template.encode()).hexdigest()[:12]
+
+
+def make_key(model: str, template: str, text: str) -> str:
+    """
+    Content address of an LLM call: hash of the model, the prompt template version
+    and the input text.
+    """
+    payload = json.dumps([model, template_version(template), text])
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+@dataclass
+class CacheStats:
+    """
+    Hit/miss counters of a cache since it was opened.
+    """
+
+    hits: int = 0
+    misses: int = 0
+    writes: int = 0
+    evictions: int = 0
+
+    def __str__(self):
+        total = self.hits + self.misses
+        rate = self.hits / total if total else 0
+        return (
+            f"{self.hits} hits, {self.misses} misses ({rate:.1%} hit rate), "
+            f"{self.writes} writes, {self.evictions} evictions"
+        )
+
+
+class LLMCache:
+    """
+    Persistent SQLite cache of LLM responses keyed by `make_key`.
+    Entries older than `ttl` seconds are ignored and evicted, and when
+    `max_entries` is set the least recently used entries are evicted beyond it,
+    when the cache is opened and closed and after `EVICT_FRACTION` of
+    `max_entries` writes.
+    In `read_only` mode the database is never modified, which keeps reruns
+    reproducible, and a missing database is an empty cache.
+    """
+
+    def __init__(
+        self,
+        path: Path = CACHE_PATH,
+        ttl: float | None = None,
+        max_entries: int | None = None,
+        read_only: bool = False,
+    ):
+        self.path = Path(path)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.read_only = read_only
+        self.stats = CacheStats()
+        # Writes since the last eviction, and access times not written yet
+        self.pending_writes = 0
+        self.accessed: dict[str, float] = {}
+        if read_only and self.path.exists():
+            self.db = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True)
+        else:
+            if read_only:
+                self.db = sqlite3.connect(":memory:")
+            else:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                self.db = sqlite3.connect(self.path)
+                self.db.execute("PRAGMA journal_mode=WAL")
+                self.db.execute("PRAGMA synchronous=NORMAL")
+            self.db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    created REAL NOT NULL,
+                    accessed REAL NOT NULL
+                )
+                """
+            )
+            self.db.execute(
+                "CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)"
+            )
+            self.db.commit()
+            self.evict()
+
+    def get(self, key: str) -> str | None:
+        """
+        Return the cached response for a key, or None on a miss.
+        """
+        row = self.db.execute(
+            "SELECT value, created FROM responses WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None or (self.ttl and time.time() - row[1] > self.ttl):
+            self.stats.misses += 1
+            return None
+        self.stats.hits += 1
+        if not self.read_only:
+            self.accessed[key] = time.time()
+            if len(self.accessed) >= ACCESS_BATCH:
+                self.flush_accessed()
+        return row[0]
+
+    def flush_accessed(self):
+        """
+        Write the access times of the hits since the last flush.
+        """
+        if self.accessed:
+            self.db.executemany(
+                "UPDATE responses SET accessed = ? WHERE key = ?",
+                ((accessed, key) for key, accessed in self.accessed.items()),
+            )
+            self.db.commit()
+            self.accessed.clear()
+
+    def put(self, key: str, value: str):
+        """
+        Store a response. Does nothing in read-only mode.
+        """
+        if self.read_only:
+            return
+        now = time.time()
+        self.db.execute(
+            "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)",
+            (key, value, now, now),
+        )
+        self.db.commit()
+        self.stats.writes += 1
+        self.pending_writes += 1
+        # Keep the size bounded during long runs, not only when opening and closing
+        if self.max_entries is not None and self.pending_writes > int(
+            self.max_entries * EVICT_FRACTION
+        ):
+            self.evict()
+
+    def evict(self):
+        """
+        Remove expired entries and trim the cache to `max_entries`.
+        """
+        if self.read_only:
+            return
+        # The least recently used entries are chosen by their access time
+        self.flush_accessed()
+        self.pending_writes = 0
+        if self.ttl:
+            cursor = self.db.execute(
+                "DELETE FROM responses WHERE created < ?", (time.time() - self.ttl,)
+            )
+            self.stats.evictions += cursor.rowcount
+        if self.max_entries is not None:
+            cursor = self.db.execute(
+                """
+                DELETE FROM responses WHERE key NOT IN (
+                    SELECT key FROM responses ORDER BY accessed DESC LIMIT ?
+                )
+                """,
+                (self.max_entries,),
+            )
+            self.stats.evictions += cursor.rowcount
+        self.db.commit()
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def close(self):
+        self.evict()
+        self.db.close()
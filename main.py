@@ -1,28 +1,56 @@
+import os
+import graph
+import zotero
+from dataset import WOS_DATASET_PATH, ZOTERO_DATASET_PATH, scan_dataset
 from dotenv import dotenv_values
 from neo4j import GraphDatabase
+from process_zotero import TARGET_COLLECTION_ID
+from zotero_store import ZoteroStore
 
 config = dotenv_values(".env")
 
-AURA_URI = config["URI"]
-AURA_USER = "neo4j"
-AURA_PASSWORD = config["PASSWORD"]
+# Environment variables take precedence, e.g. to load a local Neo4j container
+AURA_URI = os.environ.get("NEO4J_URI") or config["URI"]
+AURA_USER = os.environ.get("NEO4J_USER", "neo4j")
+AURA_PASSWORD = os.environ.get("NEO4J_PASSWORD") or config["PASSWORD"]
 
 
-def add_node(session, node_properties):
+def zotero_papers(store: ZoteroStore):
     """
-    Adds a node to the Neo4j database with the given properties.
+    Papers of the local Zotero store, attachments and notes are skipped.
     """
-    create_node_query = """
-    CREATE (n:Person {name: $name, age: $age, city: $city})
-    RETURN n
+    for item in store.values():
+        if item["data"].get("itemType") not in ("attachment", "note"):
+            yield zotero.record_from_raw(item)
+
+
+def dataset_rows(path):
+    """
+    Rows of a Parquet dataset as dicts, streamed in batches of `graph.BATCH_SIZE`.
     """
-    result = session.run(create_node_query, **node_properties)
-    return result.single()
+    for batch in scan_dataset(path).collect_batches(
+        chunk_size=graph.BATCH_SIZE, lazy=True
+    ):
+        yield from batch.iter_rows(named=True)
 
 
 with GraphDatabase.driver(AURA_URI, auth=(AURA_USER, AURA_PASSWORD)) as driver:
-    with driver.session() as session:
-        node_properties = {"name": "John Doe", "age": 30, "city": "New York"}
-        # Add a node to the database
-        node = add_node(session, node_properties)
-        print(f"Node created: {node['n']}")
+    driver.verify_connectivity()
+    graph.create_constraints(driver)
+    # Collection tree from the Zotero API
+    zot = zotero.create_zotero_client(config)
+    collections = zotero.get_all_collections(zot, TARGET_COLLECTION_ID)
+    print(f"Collections: {graph.ingest_collections(driver, collections)}")
+    # Processed Zotero items with their LLM fields, streamed from the Parquet
+    # dataset, or the items synced into the local store before processing
+    if ZOTERO_DATASET_PATH.exists():
+        rows = map(graph.paper_row_from_zotero, dataset_rows(ZOTERO_DATASET_PATH))
+        print(f"Zotero papers: {graph.ingest_papers(driver, rows)}")
+    else:
+        with ZoteroStore() as store:
+            rows = map(graph.paper_row_from_item, zotero_papers(store))
+            print(f"Zotero papers: {graph.ingest_papers(driver, rows)}")
+    # Processed WoS exports, streamed from the Parquet dataset
+    if WOS_DATASET_PATH.exists():
+        rows = map(graph.paper_row_from_wos, dataset_rows(WOS_DATASET_PATH))
+        print(f"WoS papers: {graph.ingest_papers(driver, rows)}")
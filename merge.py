@@ -0,0 +1,275 @@
+import polars as pl
+from dataset import OUTPUT_DIR, WOS_DATASET_PATH, ZOTERO_DATASET_PATH, scan_dataset
+from doi import DOI_PATTERN
+from link_resolver import RESOLVED_PATH
+from pathlib import Path
+from scholar_html import RESULTS_PATH as SCHOLAR_RESULTS_PATH
+from scholar_html import RESULTS_SCHEMA as SCHOLAR_RESULTS_SCHEMA
+
+PAPERS_PATH = OUTPUT_DIR / "papers.parquet"
+# Sources in order of preference, the first one having a field gives its value
+SOURCES = ["zotero", "wos", "scholar"]
+# Columns of the records of every source, see `zotero_frame`
+RECORD_SCHEMA = {
+    "source": pl.Utf8,
+    "source_id": pl.Utf8,
+    "doi": pl.Utf8,
+    "title": pl.Utf8,
+    "year": pl.Int32,
+    "authors": pl.Utf8,
+    "journal": pl.Utf8,
+    "abstract": pl.Utf8,
+    "link": pl.Utf8,
+    "is_agtech": pl.Utf8,
+    "agtech_sentence": pl.Utf8,
+    "agtech_reason": pl.Utf8,
+}
+# Shorter normalized titles ("Introduction", "Editorial") are not used as keys
+MIN_TITLE_KEY_LENGTH = 20
+
+
+def doi_key(column: str) -> pl.Expr:
+    """
+    Same as `doi.normalize_doi`, as a polars expression.
+    """
+    return (
+        pl.col(column)
+        .str.extract(f"(?i)({DOI_PATTERN.pattern})")
+        .str.to_lowercase()
+        .str.strip_chars_end(".")
+    )
+
+
+def title_key(column: str) -> pl.Expr:
+    """
+    Like `dedup.normalize_text`, as a polars expression, null for short titles.
+    Accents are removed and any other character separates words, so that
+    "l’irrigation" and "l'irrigation" give the same key.
+    """
+    key = (
+        pl.col(column)
+        .str.normalize("NFKD")
+        .str.replace_all(r"\p{M}", "")
+        .str.to_lowercase()
+        .str.extract_all(r"[a-z0-9]+")
+        .list.join(" ")
+    )
+    return pl.when(key.str.len_chars() >= MIN_TITLE_KEY_LENGTH).then(key)
+
+
+def answer(expr: pl.Expr) -> pl.Expr:
+    """
+    Keep Yes/No answers only, errors and unparsed answers count as unclassified.
+    """
+    return pl.when(expr.is_in(["Yes", "No"])).then(expr)
+
+
+def zotero_frame(path: Path = ZOTERO_DATASET_PATH) -> pl.LazyFrame:
+    """
+    Records of the processed Zotero dataset, see `process_zotero`.
+    Their is_agtech is the JSON answer of `llm.extract_fields`.
+    """
+    is_agtech = pl.col("is_agtech")
+    return scan_dataset(path).select(
+        pl.lit("zotero").alias("source"),
+        pl.col("id").alias("source_id"),
+        doi_key("DOI").alias("doi"),
+        "title",
+        pl.col("year").cast(pl.Int32, strict=False),
+        pl.col("authors").list.join("; "),
+        pl.col("publication").alias("journal"),
+        "abstract",
+        pl.col("url").alias("link"),
+        answer(is_agtech.str.json_path_match("$.is_agtech")).alias("is_agtech"),
+        is_agtech.str.json_path_match("$.sentence").alias("agtech_sentence"),
+        is_agtech.str.json_path_match("$.reason").alias("agtech_reason"),
+    )
+
+
+def wos_frame(path: Path = WOS_DATASET_PATH) -> pl.LazyFrame:
+    """
+    Records of the processed WoS dataset, see `process_export`.
+    """
+    agtech = pl.col("agtech").struct
+    return scan_dataset(path).select(
+        pl.lit("wos").alias("source"),
+        pl.col("DOI").alias("source_id"),
+        doi_key("DOI").alias("doi"),
+        pl.col("Article Title").alias("title"),
+        pl.col("Publication Year").cast(pl.Int32, strict=False).alias("year"),
+        pl.col("Authors").alias("authors"),
+        pl.col("Source Title").alias("journal"),
+        pl.col("Abstract").alias("abstract"),
+        pl.lit(None, pl.Utf8).alias("link"),
+        answer(agtech.field("is_agtech")).alias("is_agtech"),
+        agtech.field("sentence").alias("agtech_sentence"),
+        agtech.field("reason").alias("agtech_reason"),
+    )
+
+
+def scholar_frame(
+    links_path: Path = RESOLVED_PATH, results_path: Path = SCHOLAR_RESULTS_PATH
+) -> pl.LazyFrame:
+    """
+    Records of the Scholar links resolved by `link_resolver`, with the titles
+    parsed by `scholar_html` when its results are available. Both files hold the
+    normalized links, they are joined on them.
+    """
+    links = pl.scan_csv(links_path, schema={"url": pl.Utf8, "doi": pl.Utf8})
+    if results_path.exists():
+        results = (
+            pl.scan_csv(results_path, schema=SCHOLAR_RESULTS_SCHEMA)
+            .select("url", "title")
+            .unique("url", keep="first", maintain_order=True)
+        )
+        links = links.join(results, on="url", how="left")
+    else:
+        links = links.with_columns(pl.lit(None, pl.Utf8).alias("title"))
+    return links.select(
+        pl.lit("scholar").alias("source"),
+        pl.col("url").alias("source_id"),
+        doi_key("doi").alias("doi"),
+        "title",
+        pl.col("url").alias("link"),
+    )
+
+
+def with_schema(frame: pl.LazyFrame) -> pl.LazyFrame:
+    """
+    Select the columns of `RECORD_SCHEMA`, the ones a source does not have are null.
+    """
+    columns = frame.collect_schema().names()
+    return frame.select(
+        pl.col(name).cast(dtype) if name in columns else pl.lit(None, dtype).alias(name)
+        for name, dtype in RECORD_SCHEMA.items()
+    )
+
+
+def merge_records(*frames: pl.LazyFrame) -> pl.LazyFrame:
+    """
+    Merge the records of all sources into one canonical paper per key.
+    Records are keyed by their normalized DOI. A record without DOI takes the
+    DOI of the records having the same normalized title, as long as that title
+    has a single DOI, and is keyed by its title otherwise. Each field is taken
+    from the first source in `SOURCES` having it, and every paper keeps the
+    sources it was found in and its ID in each of them.
+    All steps are lazy hash joins and group-bys, nothing is collected here.
+    """
+    records = (
+        pl.concat([with_schema(frame) for frame in frames])
+        .with_columns(
+            pl.col(pl.Utf8).replace("", None),
+            pl.col("source").replace_strict(SOURCES, range(len(SOURCES))).alias("rank"),
+        )
+        .with_columns(title_key("title").alias("title_key"))
+    )
+    title_dois = (
+        records.filter(pl.col("doi").is_not_null() & pl.col("title_key").is_not_null())
+        .group_by("title_key")
+        .agg(pl.col("doi").unique())
+        .filter(pl.col("doi").list.len() == 1)
+        .select("title_key", pl.col("doi").list.first().alias("title_doi"))
+    )
+    records = records.join(title_dois, on="title_key", how="left").with_columns(
+        pl.coalesce(
+            "doi",
+            "title_doi",
+            pl.lit("title:") + pl.col("title_key"),
+            pl.col("source") + pl.lit(":") + pl.col("source_id"),
+        ).alias("key")
+    )
+    classified = pl.col("is_agtech").sort_by("rank").is_not_null()
+    return records.group_by("key").agg(
+        pl.col("doi").sort_by("rank").drop_nulls().first(),
+        *(
+            pl.col(name).sort_by("rank").drop_nulls().first()
+            for name in ("title", "year", "authors", "journal", "abstract", "link")
+        ),
+        *(
+            pl.col(name).sort_by("rank").filter(classified).first()
+            for name in ("is_agtech", "agtech_sentence", "agtech_reason")
+        ),
+        pl.col("source")
+        .sort_by("rank")
+        .filter(classified)
+        .first()
+        .alias("agtech_source"),
+        pl.col("source").unique().sort().alias("sources"),
+        *(
+            pl.col("source_id")
+            .filter(pl.col("source") == source)
+            .first()
+            .alias(f"{source}_id")
+            for source in SOURCES
+        ),
+        pl.len().alias("records"),
+    )
+
+
+def merge_sources(path: Path = PAPERS_PATH, csv: bool = True) -> pl.LazyFrame:
+    """
+    Merge the sources that were processed so far and write the canonical paper
+    table to `path`, streaming it from the inputs. With `csv`, also write it to a
+    CSV file next to it.
+    """
+    frames = []
+    if ZOTERO_DATASET_PATH.exists():
+        frames.append(zotero_frame())
+    if WOS_DATASET_PATH.exists():
+        frames.append(wos_frame())
+    if RESOLVED_PATH.exists():
+        frames.append(scholar_frame())
+    if not frames:
+        raise FileNotFoundError("No processed source to merge")
+    path.parent.mkdir(parents=True, exist_ok=True)
+    merge_records(*frames).sink_parquet(path)
+    if csv:
+        # CSV has no list type, join the sources
+        pl.scan_parquet(path).with_columns(pl.col("sources").list.join(", ")).sink_csv(
+            path.with_suffix(".csv")
+        )
+    return pl.scan_parquet(path)
+
+
+def reusable_answers(path: Path = PAPERS_PATH, source: str = "zotero") -> dict:
+    """
+    is_agtech answers given for papers of another source, keyed by normalized DOI
+    and by the paper's ID in `source` when it was matched to one, so they are not
+    sent to the LLM again. The answers have the keys of `IsAgtechAnswer`.
+    """
+    answers = (
+        pl.scan_parquet(path)
+        .filter(pl.col("is_agtech").is_not_null() & (pl.col("agtech_source") != source))
+        .select(
+            f"{source}_id",
+            "doi",
+            pl.col("is_agtech"),
+            pl.col("agtech_sentence").fill_null("").alias("sentence"),
+            pl.col("agtech_reason").fill_null("").alias("reason"),
+        )
+        .collect()
+    )
+    known = {}
+    for row in answers.iter_rows(named=True):
+        value = {name: row[name] for name in ("is_agtech", "sentence", "reason")}
+        for key in (row["doi"], row[f"{source}_id"]):
+            if key:
+                known[key] = value
+    return known
+
+
+if __name__ == "__main__":
+    papers = merge_sources()
+    summary = papers.select(
+        pl.len().alias("papers"),
+        pl.col("doi").is_not_null().sum().alias("with DOI"),
+        (pl.col("sources").list.len() > 1).sum().alias("in several sources"),
+        pl.col("is_agtech").is_not_null().sum().alias("classified"),
+    ).collect()
+    print(summary)
+    print(
+        papers.group_by(pl.col("sources").list.join(", "))
+        .len()
+        .sort("len", descending=True)
+        .collect()
+    )
@@ -0,0 +1,215 @@
+import os
+import shutil
+import polars as pl
+from collections import Counter
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows, reflinks are skipped there
+    fcntl = None
+
+# ioctl request to clone a file's extents (copy-on-write) on Btrfs/XFS
+FICLONE = 0x40049409
+# Statuses of a harvested PDF that is present in the target directory
+OK_STATUSES = {"hardlinked", "reflinked", "copied", "up to date"}
+
+
+@dataclass
+class HarvestResult:
+    """
+    Outcome of harvesting the PDF of one Zotero item.
+    """
+
+    id: str
+    status: str
+    source: Path | None = None
+    target: Path | None = None
+    detail: str = ""
+
+    @property
+    def ok(self) -> bool:
+        return self.status in OK_STATUSES
+
+
+def build_storage_index(storage_dir: Path) -> dict[str, list[Path]]:
+    """
+    Scan the Zotero storage directory once.
+    Return the PDF files of every attachment folder, keyed by attachment key.
+    """
+    index: dict[str, list[Path]] = {}
+    if not storage_dir.exists():
+        return index
+    with os.scandir(storage_dir) as folders:
+        for folder in folders:
+            if not folder.is_dir():
+                continue
+            with os.scandir(folder.path) as files:
+                index[folder.name] = [
+                    Path(file.path)
+                    for file in files
+                    if file.is_file() and file.name.endswith(".pdf")
+                ]
+    return index
+
+
+def attachment_key(meta) -> str | None:
+    """
+    Key of the PDF attachment of an item from its raw Zotero data, if any.
+    """
+    if attachment := meta["links"].get("attachment", None):
+        if attachment.get("attachmentType", None) == "application/pdf":
+            return attachment["href"].split("/")[-1]
+    return None
+
+
+def target_name(item) -> str:
+    """
+    File name of the harvested PDF: author, year and Zotero item ID.
+    """
+    year = getattr(item.date, "year", None) or "Unknown"
+    return f"{item.author_short} - {year} - {item.id}.pdf"
+
+
+def is_up_to_date(source: Path, target: Path) -> bool:
+    """
+    The target is the same file as the source, or a copy with the same size and
+    modification time.
+    """
+    try:
+        source_stat, target_stat = source.stat(), target.stat()
+    except FileNotFoundError:
+        return False
+    if (source_stat.st_dev, source_stat.st_ino) == (
+        target_stat.st_dev,
+        target_stat.st_ino,
+    ):
+        return True
+    return source_stat.st_size == target_stat.st_size and int(
+        source_stat.st_mtime
+    ) == int(target_stat.st_mtime)
+
+
+def reflink(source: Path, target: Path):
+    """
+    Copy-on-write clone of a file, raise OSError where unsupported.
+    """
+    if fcntl is None:
+        raise OSError("Reflinks are not supported on this platform")
+    try:
+        with source.open("rb") as src, target.open("wb") as dst:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+    except OSError:
+        target.unlink(missing_ok=True)
+        raise
+    shutil.copystat(source, target)
+
+
+def link_or_copy(source: Path, target: Path, link: bool = True) -> str:
+    """
+    Put the source file at the target path, as cheaply as possible:
+    a hardlink, then a reflink, then a regular copy (which uses `os.sendfile`
+    on Linux). Return how the file was placed.
+    """
+    target.unlink(missing_ok=True)
+    if link:
+        try:
+            os.link(source, target)
+            return "hardlinked"
+        except OSError:
+            pass
+        try:
+            reflink(source, target)
+            return "reflinked"
+        except OSError:
+            pass
+    # copy2 keeps the modification time, so the next run sees it is up to date
+    shutil.copy2(source, target)
+    return "copied"
+
+
+class PdfHarvester:
+    """
+    Copy the PDFs of Zotero items from the Zotero storage directory into a target
+    directory using a thread pool.
+    The storage directory is scanned once when the harvester is created.
+    Targets that already match their source are skipped. With `link`, files are
+    hardlinked or reflinked when the file system allows it instead of copied,
+    so use `link=False` if the copies are going to be edited.
+    """
+
+    def __init__(
+        self, storage_dir: Path, target_dir: Path, workers: int = 8, link: bool = True
+    ):
+        self.target_dir = target_dir
+        self.link = link
+        self.index = build_storage_index(storage_dir)
+        self.results: list[HarvestResult] = []
+        self.target_dir.mkdir(parents=True, exist_ok=True)
+        self._pool = ThreadPoolExecutor(workers)
+
+    def harvest(self, item, meta) -> HarvestResult:
+        """
+        Harvest the PDF of one item, `meta` is its raw Zotero data.
+        """
+        key = attachment_key(meta)
+        if key is None:
+            return HarvestResult(item.id, "no attachment")
+        files = self.index.get(key)
+        if files is None:
+            return HarvestResult(item.id, "missing", detail=key)
+        if len(files) != 1:
+            return HarvestResult(
+                item.id, "ambiguous", detail=f"{len(files)} PDF files in {key}"
+            )
+        source, target = files[0], self.target_dir / target_name(item)
+        if is_up_to_date(source, target):
+            return HarvestResult(item.id, "up to date", source, target)
+        try:
+            return HarvestResult(
+                item.id, link_or_copy(source, target, self.link), source, target
+            )
+        except OSError as e:
+            return HarvestResult(item.id, "error", source, target, str(e))
+
+    def submit(self, item, meta) -> Future:
+        """
+        Harvest an item in the thread pool, the result is also kept in `results`.
+        """
+
+        def run():
+            result = self.harvest(item, meta)
+            self.results.append(result)
+            return result
+
+        return self._pool.submit(run)
+
+    def report(self, path: Path | None = None) -> Counter:
+        """
+        Print how many items ended with each status and optionally save every
+        item's outcome as CSV.
+        """
+        counts = Counter(result.status for result in self.results)
+        print("PDFs: " + ", ".join(f"{n} {status}" for status, n in counts.items()))
+        if path is not None:
+            pl.DataFrame(
+                {
+                    "id": [result.id for result in self.results],
+                    "status": [result.status for result in self.results],
+                    "source": [str(result.source or "") for result in self.results],
+                    "target": [str(result.target or "") for result in self.results],
+                    "detail": [result.detail for result in self.results],
+                }
+            ).write_csv(path)
+        return counts
+
+    def close(self):
+        self._pool.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,164 @@
+import hashlib
+import json
+import os
+import pdfplumber
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from pypdf import PdfReader
+from tqdm import tqdm
+from typing import Iterator
+
+PDF_DIR = Path("./pdfs")
+TEXT_CACHE_DIR = Path("./output") / "pdf_text"
+# Engines in the order they are tried, pypdf is much faster than pdfplumber
+ENGINES = ("pypdf", "pdfplumber")
+# Below this many characters per page, the next engine is tried
+MIN_CHARS_PER_PAGE = 200
+# Pages are separated by a form feed in the cached text files
+PAGE_SEPARATOR = "\f"
+
+
+def file_hash(path: Path) -> str:
+    """
+    SHA-256 of a file's content, read in chunks.
+    """
+    digest = hashlib.sha256()
+    with path.open("rb") as fp:
+        while chunk := fp.read(1 << 20):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def iter_pages(path: Path, engine: str = "pypdf") -> Iterator[str]:
+    """
+    Yield the text of a PDF page by page with the given engine.
+    """
+    if engine == "pypdf":
+        reader = PdfReader(path)
+        for page in reader.pages:
+            yield page.extract_text() or ""
+    elif engine == "pdfplumber":
+        with pdfplumber.open(path) as pdf:
+            for page in pdf.pages:
+                yield page.extract_text() or ""
+                # Free the parsed layout of the page
+                page.close()
+    else:
+        raise ValueError(f"Unknown PDF engine: {engine}")
+
+
+def read_metadata(path: Path, engine: str) -> dict:
+    """
+    Document information of a PDF (title, author, ...) as strings.
+    """
+    if engine == "pypdf":
+        metadata = PdfReader(path).metadata or {}
+    else:
+        with pdfplumber.open(path) as pdf:
+            metadata = pdf.metadata
+    return {str(key).lstrip("/"): str(value) for key, value in metadata.items()}
+
+
+def extract_with(path: Path, engine: str, text_path: Path) -> dict:
+    """
+    Stream the pages of a PDF into a text file and return extraction statistics.
+    """
+    pages = chars = 0
+    with text_path.open("w", encoding="utf-8") as fp:
+        for text in iter_pages(path, engine):
+            if pages:
+                fp.write(PAGE_SEPARATOR)
+            fp.write(text)
+            pages += 1
+            chars += len(text)
+    return {"engine": engine, "pages": pages, "chars": chars}
+
+
+def extract_pdf(path: Path, cache_dir: Path = TEXT_CACHE_DIR) -> dict:
+    """
+    Extract the text of one PDF into the cache, keyed by the file's hash.
+    PDFs whose hash is already cached are not parsed again.
+    Each engine in `ENGINES` is tried in turn until one gives at least
+    `MIN_CHARS_PER_PAGE` characters per page (scanned PDFs never do).
+    Return the cached metadata, with `text` pointing to the text file.
+    """
+    digest = file_hash(path)
+    meta_path = cache_dir / f"{digest}.json"
+    text_path = cache_dir / f"{digest}.txt"
+    if meta_path.exists():
+        with meta_path.open("r") as fp:
+            meta = json.load(fp)
+        return {**meta, "source": str(path), "cached": True}
+
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    tmp_path = text_path.with_suffix(f".{os.getpid()}.tmp")
+    best, errors = None, {}
+    for engine in ENGINES:
+        try:
+            stats = extract_with(path, engine, tmp_path)
+        except Exception as e:
+            errors[engine] = f"{type(e).__name__}: {e}"
+            continue
+        if best is None or stats["chars"] > best["chars"]:
+            best = stats
+            os.replace(tmp_path, text_path)
+        if stats["chars"] >= MIN_CHARS_PER_PAGE * stats["pages"]:
+            break
+    tmp_path.unlink(missing_ok=True)
+    if best is None:
+        return {"hash": digest, "source": str(path), "errors": errors}
+
+    meta = {
+        "hash": digest,
+        "source": str(path),
+        **best,
+        "metadata": read_metadata(path, best["engine"]),
+        "text": str(text_path),
+        "errors": errors,
+    }
+    # The metadata file is written last, it marks the cache entry as complete
+    with meta_path.with_suffix(".tmp").open("w") as fp:
+        json.dump(meta, fp)
+    os.replace(meta_path.with_suffix(".tmp"), meta_path)
+    return {**meta, "cached": False}
+
+
+def extract_all(
+    pdf_dir: Path = PDF_DIR,
+    cache_dir: Path = TEXT_CACHE_DIR,
+    workers: int | None = None,
+) -> list[dict]:
+    """
+    Extract the text of every PDF in a directory with a process pool.
+    Return the metadata of each PDF, see `extract_pdf`.
+    """
+    paths = sorted(pdf_dir.glob("*.pdf"))
+    results = []
+    with ProcessPoolExecutor(workers) as pool:
+        futures = [pool.submit(extract_pdf, path, cache_dir) for path in paths]
+        for future in tqdm(as_completed(futures), total=len(futures), desc="PDFs"):
+            results.append(future.result())
+    failed = [result for result in results if "text" not in result]
+    cached = sum(result.get("cached", False) for result in results)
+    print(f"Extracted {len(results)} PDFs, {cached} from cache, {len(failed)} failed.")
+    return results
+
+
+def iter_cached_pages(text_path: Path) -> Iterator[str]:
+    """
+    Lazily yield the pages of a cached text file.
+    """
+    page = []
+    with Path(text_path).open("r", encoding="utf-8") as fp:
+        for line in fp:
+            while PAGE_SEPARATOR in line:
+                head, line = line.split(PAGE_SEPARATOR, 1)
+                page.append(head)
+                yield "".join(page)
+                page = []
+            page.append(line)
+    yield "".join(page)
+
+
+if __name__ == "__main__":
+    extract_all()
@@ -0,0 +1,289 @@
+import json
+import re
+import numpy as np
+import polars as pl
+from pathlib import Path
+from scipy.optimize import minimize
+from scipy.sparse import csr_matrix
+from dataset import OUTPUT_DIR, WOS_DATASET_PATH, scan_dataset
+
+MODEL_PATH = OUTPUT_DIR / "prefilter.json"
+# Parquet dataset written by `process_export`
+LABELS_PATH = WOS_DATASET_PATH
+# Abstracts with a probability of being AgTech outside of these thresholds are
+# decided locally, the ones in between still go to the LLM
+LOW_THRESHOLD = 0.1
+HIGH_THRESHOLD = 0.9
+# Precision the thresholds are tuned for by `fit_thresholds`
+TARGET_PRECISION = 0.97
+# Tuned thresholds never get closer to 0.5 than this, even on easy data
+MIN_CONFIDENCE = 0.7
+# Words in fewer abstracts than this are left out of the vocabulary
+MIN_DOCUMENT_FREQUENCY = 2
+# Start of the LLM answer's reason for abstracts decided by the prefilter, these are not
+# used as training labels
+REASON_PREFIX = "Local prefilter"
+TOKEN_PATTERN = re.compile(r"[a-z][a-z0-9-]+")
+
+
+def tokenize(text: str) -> list[str]:
+    """
+    Lowercase words and the bigrams of consecutive words.
+    """
+    words = TOKEN_PATTERN.findall(text.lower())
+    return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+
+class Prefilter:
+    """
+    TF-IDF + logistic regression classifier of AgTech abstracts, trained on the
+    labels given by the LLM. It only decides abstracts it is confident about
+    (see `decide`), so the LLM is only asked about the uncertain ones.
+    """
+
+    def __init__(
+        self,
+        vocabulary: dict[str, int],
+        idf: np.ndarray,
+        weights: np.ndarray,
+        bias: float,
+        low: float = LOW_THRESHOLD,
+        high: float = HIGH_THRESHOLD,
+    ):
+        self.vocabulary = vocabulary
+        self.idf = idf
+        self.weights = weights
+        self.bias = bias
+        self.low = low
+        self.high = high
+
+    @staticmethod
+    def counts(abstracts: list[str], vocabulary: dict[str, int]) -> csr_matrix:
+        """
+        Sparse abstract × term count matrix, terms outside the vocabulary are dropped.
+        """
+        rows, columns = [], []
+        for row, abstract in enumerate(abstracts):
+            for token in tokenize(abstract):
+                if (column := vocabulary.get(token)) is not None:
+                    rows.append(row)
+                    columns.append(column)
+        return csr_matrix(
+            (np.ones(len(rows)), (rows, columns)),
+            shape=(len(abstracts), len(vocabulary)),
+        )
+
+    def features(self, abstracts: list[str]) -> csr_matrix:
+        """
+        L2 normalized TF-IDF vectors with sublinear term frequencies.
+        """
+        matrix = self.counts(abstracts, self.vocabulary)
+        matrix.data = 1 + np.log(matrix.data)
+        matrix = matrix.multiply(self.idf).tocsr()
+        norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+        norms[norms == 0] = 1
+        return csr_matrix(matrix.multiply(1 / norms[:, None]))
+
+    @classmethod
+    def fit(
+        cls,
+        abstracts: list[str],
+        labels: np.ndarray,
+        regularization: float = 1.0,
+        min_df: int = MIN_DOCUMENT_FREQUENCY,
+    ) -> "Prefilter":
+        """
+        Train on abstracts labelled True (AgTech) or False.
+        """
+        document_frequency: dict[str, int] = {}
+        for abstract in abstracts:
+            for token in set(tokenize(abstract)):
+                document_frequency[token] = document_frequency.get(token, 0) + 1
+        vocabulary = {}
+        for token, n in document_frequency.items():
+            if n >= min_df:
+                vocabulary[token] = len(vocabulary)
+        frequency = np.array(
+            [document_frequency[token] for token in vocabulary], dtype=float
+        )
+        idf = np.log((1 + len(abstracts)) / (1 + frequency)) + 1
+        model = cls(vocabulary, idf, np.zeros(len(vocabulary)), 0.0)
+        x = model.features(abstracts)
+        y = np.asarray(labels, dtype=float)
+
+        def loss(params):
+            """
+            L2 regularized log loss and its gradient.
+            """
+            weights, bias = params[:-1], params[-1]
+            z = x @ weights + bias
+            # log(1 + exp(z)) - y * z, computed without overflow
+            value = np.logaddexp(0, z).sum() - y @ z
+            error = 1 / (1 + np.exp(-z)) - y
+            gradient = np.append(x.T @ error + regularization * weights, error.sum())
+            return value + regularization * weights @ weights / 2, gradient
+
+        result = minimize(
+            loss, np.zeros(len(vocabulary) + 1), jac=True, method="L-BFGS-B"
+        )
+        model.weights, model.bias = result.x[:-1], float(result.x[-1])
+        return model
+
+    def predict_proba(self, abstracts: list[str]) -> np.ndarray:
+        """
+        Probability of each abstract being AgTech.
+        """
+        if not abstracts:
+            return np.zeros(0)
+        return 1 / (1 + np.exp(-(self.features(abstracts) @ self.weights + self.bias)))
+
+    def decide(self, probabilities: np.ndarray) -> list[str | None]:
+        """
+        "Yes" or "No" for the abstracts the prefilter is confident about,
+        None for the ones that should go to the LLM.
+        """
+        return [
+            "Yes" if p >= self.high else "No" if p <= self.low else None
+            for p in probabilities
+        ]
+
+    def fit_thresholds(
+        self,
+        probabilities: np.ndarray,
+        labels: np.ndarray,
+        precision: float = TARGET_PRECISION,
+    ):
+        """
+        Widest thresholds that keep the precision of local "Yes" and local "No"
+        decisions at or above `precision` on held-out labelled abstracts.
+        """
+        labels = np.asarray(labels, dtype=bool)
+        order = np.argsort(-probabilities, kind="stable")
+        # Precision of "Yes" when the threshold is lowered to each probability
+        yes_precision = np.cumsum(labels[order]) / np.arange(1, len(order) + 1)
+        ok = np.flatnonzero(yes_precision >= precision)
+        self.high = (
+            max(float(probabilities[order[ok[-1]]]), MIN_CONFIDENCE) if len(ok) else 1.0
+        )
+        order = order[::-1]
+        no_precision = np.cumsum(~labels[order]) / np.arange(1, len(order) + 1)
+        ok = np.flatnonzero(no_precision >= precision)
+        self.low = (
+            min(float(probabilities[order[ok[-1]]]), 1 - MIN_CONFIDENCE)
+            if len(ok)
+            else 0.0
+        )
+
+    def evaluate(self, abstracts: list[str], labels: np.ndarray) -> dict:
+        """
+        Compare the local decisions with the LLM labels.
+        Precision and recall are for "Yes" among the abstracts decided locally,
+        `calls_saved` is the number of abstracts the LLM would not be asked about.
+        """
+        labels = np.asarray(labels, dtype=bool)
+        decisions = self.decide(self.predict_proba(abstracts))
+        decided = np.array([decision is not None for decision in decisions])
+        predicted = np.array([decision == "Yes" for decision in decisions])
+        true_positive = (predicted & labels).sum()
+        return {
+            "abstracts": len(abstracts),
+            "calls_saved": int(decided.sum()),
+            "saved_ratio": float(decided.mean()) if len(abstracts) else 0.0,
+            "accuracy": float((predicted == labels)[decided].mean())
+            if decided.any()
+            else 0.0,
+            "precision": float(true_positive / predicted.sum())
+            if predicted.any()
+            else 0.0,
+            "recall": float(true_positive / (labels & decided).sum())
+            if (labels & decided).any()
+            else 0.0,
+            "missed_agtech": int((~predicted & labels & decided).sum()),
+        }
+
+    def save(self, path: Path = MODEL_PATH):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with path.open("w") as fp:
+            json.dump(
+                {
+                    "vocabulary": list(self.vocabulary),
+                    "idf": self.idf.tolist(),
+                    "weights": self.weights.tolist(),
+                    "bias": self.bias,
+                    "low": self.low,
+                    "high": self.high,
+                },
+                fp,
+            )
+
+    @classmethod
+    def load(cls, path: Path = MODEL_PATH) -> "Prefilter":
+        with path.open("r") as fp:
+            data = json.load(fp)
+        return cls(
+            {token: index for index, token in enumerate(data["vocabulary"])},
+            np.array(data["idf"]),
+            np.array(data["weights"]),
+            data["bias"],
+            data["low"],
+            data["high"],
+        )
+
+
+def load_labels(path: Path = LABELS_PATH) -> pl.DataFrame:
+    """
+    Abstracts labelled by the LLM in the processed WoS dataset.
+    Errors and abstracts decided by the prefilter itself are left out.
+    """
+    return (
+        scan_dataset(path)
+        .select("Abstract", pl.col("agtech").struct.field("is_agtech", "reason"))
+        .filter(
+            pl.col("is_agtech").is_in(["Yes", "No"])
+            & ~pl.col("reason").fill_null("").str.starts_with(REASON_PREFIX)
+        )
+        .with_columns((pl.col("is_agtech") == "Yes").alias("label"))
+        .collect()
+    )
+
+
+def train(path: Path = LABELS_PATH, seed: int = 0) -> tuple[Prefilter, dict]:
+    """
+    Train a prefilter on the LLM labels.
+    The labelled abstracts are split 60/20/20: the model is fitted on the first
+    part, the thresholds are tuned on the second and the report is computed on
+    the last. The returned model is the one the thresholds were tuned for and
+    the report describes, it is not refitted on the other parts.
+    """
+    labels = load_labels(path)
+    abstracts = labels["Abstract"].to_list()
+    y = labels["label"].to_numpy()
+    order = np.random.default_rng(seed).permutation(len(abstracts))
+    fit_part, tune_part, test_part = np.split(
+        order, [int(0.6 * len(order)), int(0.8 * len(order))]
+    )
+
+    def subset(indices):
+        return [abstracts[i] for i in indices], y[indices]
+
+    model = Prefilter.fit(*subset(fit_part))
+    tune_abstracts, tune_labels = subset(tune_part)
+    model.fit_thresholds(model.predict_proba(tune_abstracts), tune_labels)
+    report = model.evaluate(*subset(test_part))
+    return model, report
+
+
+if __name__ == "__main__":
+    model, report = train()
+    print(f"Thresholds: No below {model.low:.3f}, Yes above {model.high:.3f}")
+    print(
+        f"Held-out abstracts: {report['abstracts']}, "
+        f"decided locally: {report['calls_saved']} ({report['saved_ratio']:.0%})"
+    )
+    print(
+        f"Local decisions vs LLM: accuracy {report['accuracy']:.3f}, "
+        f"precision {report['precision']:.3f}, recall {report['recall']:.3f}, "
+        f"AgTech abstracts rejected: {report['missed_agtech']}"
+    )
+    model.save()
+    print(f"Model saved to {MODEL_PATH}")
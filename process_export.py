@@ -1,55 +1,238 @@
 import llm
 import asyncio
-import json
+import dataclasses
 import polars as pl
+from checkpoint import Checkpoint
+from dataset import OUTPUT_DIR, WOS_DATASET_PATH, reset_dataset, write_dataset
 from pathlib import Path
-from tqdm.asyncio import tqdm
+from typing import Iterable, Iterator
+from prefilter import MODEL_PATH, REASON_PREFIX, Prefilter
+from response_parser import IsAgtechAnswer, ParseError, RetryItem, RetryQueue, parse
 
 
 # Set path
 
 PATH = Path(".")
+CHECKPOINT_PATH = PATH / "output" / "processed_wos_checkpoint.jsonl"
+# Columns of interest, see `process_web_of_science_export`
+WOS_COLUMNS = [
+    "Publication Type",
+    "Document Type",
+    "Authors",
+    "Article Title",
+    "Source Title",
+    "Conference Title",
+    "DOI",
+    "Publication Year",
+    "Publication Date",
+    "Abstract",
+]
+# Tab-delimited WoS exports use field tags instead of column names
+WOS_TAGS = {
+    "PT": "Publication Type",
+    "DT": "Document Type",
+    "AU": "Authors",
+    "TI": "Article Title",
+    "SO": "Source Title",
+    "CT": "Conference Title",
+    "DI": "DOI",
+    "PY": "Publication Year",
+    "PD": "Publication Date",
+    "AB": "Abstract",
+}
+# Papers read, sent to the LLM and written at a time, this bounds peak memory
+CHUNK_SIZE = 5000
+# The dataset of processed papers is partitioned by publication year
+PARTITION_COLUMN = "Publication Year"
 
 
-def process_response(response: str) -> dict:
+def scan_wos(path: Path) -> pl.LazyFrame:
     """
-    Process the response from the LLM and extract the relevant information.
-    Return a dictionary with the following structure:
-        is_agtech: "Yes" or "No" or "Error" if there is processing is failed
-        sentence: The sentence in the abstract that indicates whether it's AgTech or not.
-        reason: A brief explanation of why LLM think it's AgTech or not based on the abstract.
+    Lazily read the columns of interest of one WoS export, all as strings.
+    Tab-delimited exports (.txt) are scanned, so only the needed columns are
+    parsed. Excel exports are read at once, WoS limits them to 1000 records.
+    """
+    if path.suffix.lower() in (".xls", ".xlsx"):
+        return pl.read_excel(path, columns=WOS_COLUMNS, infer_schema_length=0).lazy()
+    return (
+        pl.scan_csv(
+            path,
+            separator="\t",
+            quote_char=None,
+            infer_schema=False,
+            encoding="utf8-lossy",
+            truncate_ragged_lines=True,
+        )
+        .rename(WOS_TAGS, strict=False)
+        .select(WOS_COLUMNS)
+    )
 
-    In case of error, the raw response will be stored in the reason field for debugging purposes.
+
+def iter_wos_chunks(
+    paths: Iterable[Path], chunk_size: int = CHUNK_SIZE
+) -> Iterator[pl.DataFrame]:
     """
-    try:
-        # Extract JSON from response
-        response = response[response.find("{") : response.rfind("}") + 1]
-        response = json.loads(response)
-        return {
-            "is_agtech": response.get("is_agtech", "Error"),
-            "sentence": response.get("sentence", ""),
-            "reason": response.get("reason", ""),
-        }
-
-    except json.JSONDecodeError as e:
-        raise RuntimeError(f"Error decoding JSON: {e}") from e
-    except KeyError as e:
-        raise RuntimeError(f"Missing expected key in response: {e}") from e
-    except Exception as e:
-        raise RuntimeError(f"Unexpected error processing response: {e}") from e
+    Yield chunks of at most `chunk_size` papers having a title, a DOI and an
+    abstract from one or several WoS exports, in order.
+    """
+    for path in paths:
+        papers = scan_wos(Path(path)).filter(
+            (pl.col("Article Title").is_not_null())
+            & (pl.col("DOI").is_not_null())
+            & (pl.col("Abstract").is_not_null())
+        )
+        yield from papers.collect_batches(chunk_size=chunk_size, lazy=True)
 
-    finally:
-        # In case of any error, return the raw response for debugging
-        return {
-            "is_agtech": "Error",
-            "sentence": "",
-            "reason": json.dumps(response, indent=2),
-        }
 
+async def process_chunk(
+    chunk: pl.DataFrame,
+    checkpoint: Checkpoint,
+    batched: bool = False,
+    prefilter: Prefilter | None = None,
+) -> tuple[dict[str, str], int]:
+    """
+    Classify the papers of a chunk that are not in the checkpoint yet.
+    Finished papers are appended to the checkpoint. Return the errors of the
+    other ones keyed by DOI, and how many papers the prefilter decided.
+    """
+    pending = chunk.filter(~pl.col("DOI").is_in(list(checkpoint.records))).unique(
+        "DOI", maintain_order=True
+    )
+    decided = 0
+    if prefilter is not None:
+        probabilities = prefilter.predict_proba(pending["Abstract"].to_list())
+        decisions = prefilter.decide(probabilities)
+        for doi, decision, p in zip(pending["DOI"], decisions, probabilities):
+            if decision is not None:
+                checkpoint.append(
+                    doi,
+                    {
+                        "is_agtech": decision,
+                        "agtech_sentence": "",
+                        "agtech_reason": f"{REASON_PREFIX}, P(AgTech) = {p:.3f}",
+                    },
+                )
+        pending = pending.filter(
+            pl.Series([decision is None for decision in decisions], dtype=pl.Boolean)
+        )
+        decided = len(decisions) - len(pending)
+    dois = pending["DOI"].to_list()
+    abstracts = pending["Abstract"].to_list()
+    errors = {}
+    retries = RetryQueue()
+
+    def save(key: str, answer: IsAgtechAnswer):
+        checkpoint.append(
+            key,
+            {
+                "is_agtech": answer.is_agtech,
+                "agtech_sentence": answer.sentence,
+                "agtech_reason": answer.reason,
+            },
+        )
+
+    def save_response(index: int, response: str):
+        """
+        Append a finished paper to the checkpoint.
+        Unparseable answers are queued to be asked again.
+        """
+        try:
+            save(dois[index], parse(IsAgtechAnswer, response))
+        except ParseError as e:
+            retries.add(
+                RetryItem(
+                    dois[index],
+                    llm.IS_AGTECH_PROMPT,
+                    abstracts[index],
+                    e.content,
+                    str(e),
+                )
+            )
+
+    async def classify(index: int, abstract: str) -> str:
+        response = await llm.is_agtech_abstract(abstract)
+        save_response(index, response)
+        return response
 
-async def process_web_of_science_export(file_path):
+    async def retry(item: RetryItem):
+        response = await llm.ask_again(item.template, item.text)
+        try:
+            save(item.key, parse(IsAgtechAnswer, response))
+        except ParseError as e:
+            retries.add(
+                dataclasses.replace(
+                    item, content=e.content, error=str(e), attempts=item.attempts + 1
+                )
+            )
+
+    if not dois:
+        return errors, decided
+    if batched:
+        _, failed = await llm.is_agtech_batch(abstracts, on_result=save_response)
+    else:
+        tasks = [classify(index, abstract) for index, abstract in enumerate(abstracts)]
+        _, failed = await llm.gather(tasks, desc="Abstracts")
+    # Requests that failed after all retries
+    errors.update({dois[error.index]: str(error) for error in failed})
+    # Ask again for unparseable answers, reminding the model to answer in JSON
+    while items := retries.drain():
+        _, failed = await llm.gather([retry(item) for item in items], desc="Retries")
+        errors.update({items[error.index].key: str(error) for error in failed})
+    # Keep the last raw answer of the ones that never parsed, for debugging
+    errors.update({item.key: item.content for item in retries.failed})
+    return errors, decided
+
+
+def results_frame(
+    checkpoint: Checkpoint, dois: Iterable[str], errors: dict[str, str]
+) -> pl.DataFrame:
+    """
+    LLM answers of papers as an `agtech` struct column keyed by DOI.
+    Finished papers come from the checkpoint, the others keep their error.
     """
-    Process a Web of Science export file.
+    finished = pl.DataFrame(
+        [
+            {"DOI": doi, **checkpoint.records[doi]}
+            for doi in set(dois)
+            if doi in checkpoint
+        ],
+        schema={
+            "DOI": pl.Utf8,
+            "is_agtech": pl.Utf8,
+            "agtech_sentence": pl.Utf8,
+            "agtech_reason": pl.Utf8,
+        },
+    ).select(
+        "DOI",
+        pl.struct(
+            "is_agtech",
+            pl.col("agtech_sentence").alias("sentence"),
+            pl.col("agtech_reason").alias("reason"),
+        ).alias("agtech"),
+    )
+    failed = pl.DataFrame(
+        {"DOI": list(errors), "reason": list(errors.values())},
+        schema={"DOI": pl.Utf8, "reason": pl.Utf8},
+    ).select(
+        "DOI",
+        pl.struct(
+            pl.lit("Error").alias("is_agtech"),
+            pl.lit("").alias("sentence"),
+            "reason",
+        ).alias("agtech"),
+    )
+    return pl.concat([finished, failed])
+
+
+async def process_web_of_science_export(
+    file_paths: Path | Iterable[Path],
+    batched: bool = False,
+    prefilter: Prefilter | None = None,
+    chunk_size: int = CHUNK_SIZE,
+    csv: bool = True,
+):
+    """
+    Process one or several Web of Science exports (.xls or tab-delimited .txt).
     Columns of interest:
     - Publication Type: Indicating the type of publication
     - Document Type: Type of document
@@ -61,49 +244,75 @@ async def process_web_of_science_export(file_path):
     - Publication Year: Year of publication
     - Publication Date: Full date of publication
     - Abstract: Summary of the article
+
+    Papers are read, classified and written `chunk_size` at a time, so memory use
+    does not grow with the size of the exports. The LLM answer of each paper is
+    kept in an `agtech` struct column (is_agtech, sentence, reason) of the
+    Parquet dataset in `WOS_DATASET_PATH`, and flattened into columns in
+    `processed_wos.csv` when `csv` is set.
+    With `batched`, several abstracts are sent in each LLM request
+    (see `llm.is_agtech_batch`) instead of one request per abstract.
+    With a `prefilter`, abstracts it is confident about are decided locally and
+    only the other ones are sent to the LLM.
     """
-    wos = pl.read_excel(file_path)
-    # Print number of total papers
-    print(f"Total papers: {len(wos)}")
-    # Remove papers that does not have title, DOI or abstract
-    wos = wos.filter(
-        (pl.col("Article Title").is_not_null())
-        & (pl.col("DOI").is_not_null())
-        & (pl.col("Abstract").is_not_null())
-    )
-    print(f"Papers with title, DOI and abstract: {len(wos)}")
-    # Only keep columns of interest
-    wos = wos.select(
-        [
-            "Publication Type",
-            "Document Type",
-            "Authors",
-            "Article Title",
-            "Source Title",
-            "Conference Title",
-            "DOI",
-            "Publication Year",
-            "Publication Date",
-            "Abstract",
-        ]
-    )
-    # Process abstracts
-    tasks = [llm.is_agtech_abstract(abstract) for abstract in wos["Abstract"]]
+    if isinstance(file_paths, (str, Path)):
+        file_paths = [file_paths]
+    # Skip papers finished in a previous run, results are kept in the checkpoint
+    checkpoint = Checkpoint(CHECKPOINT_PATH)
+    done_before = len(checkpoint)
+    papers = failed = saved = part = 0
+    csv_path = OUTPUT_DIR / "processed_wos.csv"
+    errors_path = OUTPUT_DIR / "processed_wos_errors.csv"
+    reset_dataset(WOS_DATASET_PATH)
+    csv_file = csv_path.open("wb") if csv else None
     print("Processed abstracts ...")
-    is_agtech = await tqdm.gather(*tasks)
-    # Process the responses and extract relevant information
-    responses = [process_response(response) for response in is_agtech]
-    # Add the extracted information to the DataFrame
-    wos = wos.with_columns(
-        pl.Series("is_agtech", [response["is_agtech"] for response in responses]),
-        pl.Series("agtech_sentence", [response["sentence"] for response in responses]),
-        pl.Series("agtech_reason", [response["reason"] for response in responses]),
-    )
-
-    # Save to CSV
-    wos.write_csv(PATH / "output" / "processed_wos.csv")
+    try:
+        with errors_path.open("wb") as errors_file:
+            for part, chunk in enumerate(iter_wos_chunks(file_paths, chunk_size)):
+                errors, decided = await process_chunk(
+                    chunk, checkpoint, batched, prefilter
+                )
+                saved += decided
+                chunk = chunk.join(
+                    results_frame(checkpoint, chunk["DOI"], errors),
+                    on="DOI",
+                    how="left",
+                )
+                write_dataset(chunk, WOS_DATASET_PATH, PARTITION_COLUMN, part)
+                if csv_file is not None:
+                    chunk.with_columns(
+                        pl.col("agtech").struct.field("is_agtech"),
+                        pl.col("agtech")
+                        .struct.field("sentence")
+                        .alias("agtech_sentence"),
+                        pl.col("agtech").struct.field("reason").alias("agtech_reason"),
+                    ).drop("agtech").write_csv(csv_file, include_header=part == 0)
+                pl.DataFrame(
+                    {"DOI": list(errors), "error": list(errors.values())},
+                    schema={"DOI": pl.Utf8, "error": pl.Utf8},
+                ).write_csv(errors_file, include_header=part == 0)
+                papers += len(chunk)
+                failed += len(errors)
+    finally:
+        await llm.close_client()
+        checkpoint.close()
+        if csv_file is not None:
+            csv_file.close()
+    print(f"Papers with title, DOI and abstract: {papers}")
+    print(f"Papers already processed: {done_before}")
+    if prefilter is not None:
+        print(f"Decided by the prefilter: {saved} LLM calls saved")
+    if cache := llm.get_cache():
+        print(f"LLM cache: {cache.stats}")
+    if failed:
+        print(f"{failed} abstracts failed, see {errors_path.name}")
 
 
 if __name__ == "__main__":
-    # Load export file from Web of Science
-    asyncio.run(process_web_of_science_export(PATH / "export_wos.xls"))
+    # Load export files from Web of Science
+    exports = sorted(PATH.glob("export_wos*.xls")) + sorted(
+        PATH.glob("export_wos*.txt")
+    )
+    # Use the prefilter once it has been trained, see prefilter.py
+    prefilter = Prefilter.load(MODEL_PATH) if MODEL_PATH.exists() else None
+    asyncio.run(process_web_of_science_export(exports, prefilter=prefilter))
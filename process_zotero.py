@@ -1,13 +1,19 @@
 import zotero
-import shutil
 import llm
 import asyncio
+import dataclasses
 import json
 import polars as pl
 from dotenv import dotenv_values
 from pathlib import Path
+from pydantic.dataclasses import dataclass
 from tqdm.asyncio import tqdm
-from dataclasses import dataclass
+from typing import Iterator
+from checkpoint import Checkpoint
+from dataset import OUTPUT_DIR, ZOTERO_DATASET_PATH, reset_dataset, write_dataset
+from doi import normalize_doi
+from merge import PAPERS_PATH, reusable_answers
+from pdf_harvest import HarvestResult, PdfHarvester
 
 
 @dataclass
@@ -21,50 +27,95 @@ class Paper(zotero.ZoteroItem):
 TARGET_COLLECTION_ID = "INADL5PC"
 PDF_TARGET_DIR = Path("./pdfs")
 PDF_DOWNLOAD_DIR = Path("/home/tam/Zotero/storage")
+# Also write the papers to zotero_items.csv
+WRITE_CSV = True
 
 
-def move_pdf(meta) -> bool:
+async def process_papers(
+    items: Iterator[Paper],
+    zot,
+    store: zotero.ZoteroStore,
+    checkpoint: Checkpoint,
+    known: dict[str, dict] | None = None,
+) -> list[Paper]:
     """
-    Move PDF from source to target location.
-    Return True if PDF moved, False otherwise.
+    Process all papers streamed from Zotero.
+    PDFs are harvested in a thread pool and abstracts that are not in the
+    checkpoint yet are sent to the LLM while later items are still downloading.
+    Each finished paper is appended to the checkpoint right away.
+    `known` holds is_agtech answers given in other sources, keyed by item ID or
+    DOI (see `merge.reusable_answers`): papers known not to be AgTech are not
+    sent to the LLM.
     """
-    is_completed = False
-
-    if attachment := meta["links"].get("attachment", None):
-        if attachment.get("attachmentType", None) == "application/pdf":
-            # Extract PDF to target directory
-            pdf_location = PDF_DOWNLOAD_DIR / attachment["href"].split("/")[-1]
-            if pdf_location.exists():
-                # List files in the directory and find the PDF
-                files = [
-                    file
-                    for file in pdf_location.iterdir()
-                    if file.is_file() and file.suffix == ".pdf"
-                ]
-                try:
-                    # Copy the PDF to target location with DOI as filename
-                    target_location = (
-                        PDF_TARGET_DIR
-                        / f"{item.author_short} - {item.date.year if item.date else 'Unknown'} - {item.id}.pdf"
+    known = known or {}
+    papers: list[Paper] = []
+    tasks = []
+    done = reused = 0
+    with PdfHarvester(PDF_DOWNLOAD_DIR, PDF_TARGET_DIR) as harvester:
+        with tqdm(desc="Items") as progress:
+            # Pull items from a worker thread so other work keeps running meanwhile
+            while (paper := await asyncio.to_thread(next, items, None)) is not None:
+                progress.update()
+                # Skip items that are not in the target collection (it is not a main item)
+                if TARGET_COLLECTION_ID not in paper.collections:
+                    continue
+                # Retrieve raw metadata
+                meta = store.get(paper.id) or zotero.get_item(zot, paper.id)
+                # Harvest PDF if exists
+                harvest = asyncio.wrap_future(harvester.submit(paper, meta))
+                papers.append(paper)
+                done += paper.id in checkpoint
+                answer = known.get(paper.id) or known.get(normalize_doi(paper.DOI))
+                reused += answer is not None and paper.id not in checkpoint
+                tasks.append(
+                    asyncio.ensure_future(
+                        process_paper(paper, harvest, checkpoint, answer)
                     )
-                    if len(files) == 1:
-                        shutil.copy(files[0], target_location)
-                        is_completed = True
-                    else:
-                        print(f"Multiple or no PDF files found for item {item.id}")
-                except Exception as e:
-                    print(f"Error copying PDF for item {item.id}: {e}")
-
-    return is_completed
-
-
-async def process_papers(papers: list[Paper]):
+                )
+
+        print(f"Found {len(papers)} papers, {done} already processed.")
+        if reused:
+            print(f"Reusing {reused} is_agtech answers from other sources.")
+        try:
+            _, errors = await llm.gather(tasks, desc="Papers")
+        finally:
+            await llm.close_client()
+        harvester.report(Path(".") / "output" / "pdf_harvest.csv")
+    if cache := llm.get_cache():
+        print(f"LLM cache: {cache.stats}")
+    # Failed papers keep empty LLM fields, report them instead of aborting the run
+    if errors:
+        print(f"{len(errors)} papers failed, see zotero_errors.csv")
+        pl.DataFrame(
+            {
+                "id": [papers[error.index].id for error in errors],
+                "error": [str(error) for error in errors],
+            }
+        ).write_csv(Path(".") / "output" / "zotero_errors.csv")
+    return papers
+
+
+async def process_paper(
+    paper: Paper, harvest, checkpoint: Checkpoint, answer: dict | None = None
+):
     """
-    Process all papers
+    Process a paper and record the result in the checkpoint.
+    Papers already in the checkpoint only get their PDF flag updated.
+    Papers with an `answer` from another source saying they are not AgTech keep
+    it, the others still need the LLM for their technology, location and
+    participants.
     """
-
-    tasks = [process_abstract(paper) for paper in papers]
-    await tqdm.gather(*tasks)
+    result: HarvestResult = await harvest
+    paper.pdf = result.ok
+    if record := checkpoint.records.get(paper.id):
+        if record["pdf"] != paper.pdf:
+            checkpoint.append(paper.id, {**record, "pdf": paper.pdf})
+        return
+    if answer and answer["is_agtech"] == "No":
+        paper.is_agtech = json.dumps(answer)
+    else:
+        await process_abstract(paper)
+    checkpoint.append(paper.id, dataclasses.asdict(paper))
 
 
 async def process_abstract(paper: Paper):
@@ -72,10 +123,11 @@ async def process_abstract(paper: Paper):
     Process a paper's abstract
     """
     if paper.abstract:
-        paper.is_agtech = await llm.is_agtech_abstract(paper.abstract)
-        paper.technology = await llm.technology_from_abstract(paper.abstract)
-        paper.location = await llm.location_from_abstract(paper.abstract)
-        paper.participants = await llm.participants_from_abstract(paper.abstract)
+        fields = await llm.extract_fields(paper.abstract)
+        paper.is_agtech = fields["is_agtech"]
+        paper.technology = fields["technology"]
+        paper.location = fields["location"]
+        paper.participants = fields["participants"]
     else:
         paper.is_agtech = "No abstract provided."
 
@@ -84,50 +136,30 @@ if __name__ == "__main__":
     # Initialize Zotero client
     config = dotenv_values(".env")
     zot = zotero.create_zotero_client(config)
-    # Retrieve all items including sub-collections
-    items = zotero.get_all_items(zot, TARGET_COLLECTION_ID)
-    print(f"Found {len(items)} items. Processing...")
-    # Process each item
-    papers: list[Paper] = []
-    # Open Zotero metadata cache
-    cache_path = Path("./output") / "zotero_cache.json"
-    with cache_path.open("r") as fp:
-        cache = json.load(fp)
-    for item in tqdm(items):
-        # Skip items that are not in the target collection (it is not a main item)
-        if TARGET_COLLECTION_ID not in item.collections:
-            continue
-        # Retrieve raw metadata
-        if item.id in cache:
-            meta = cache[item.id]
-        else:
-            meta = zotero.get_item(zot, item.id)
-        # Convert to paper dataclass for further processing
-        paper = Paper(**item.__dict__)
-        # Move PDF if exists
-        paper.pdf = move_pdf(meta)
-        papers.append(paper)
-
-    # Process abstracts
-    print(f"Found {len(papers)} papers. Processing ...")
-    asyncio.run(process_papers(papers))
-
-    # Create DataFrame
-    df = pl.DataFrame(papers)
-    # Author column is list of list of strings, flatten it
-    df = df.with_columns(
-        pl.col("authors")
-        .map_elements(
-            lambda authors: [author["name"] for author in authors],
-            return_dtype=pl.List(pl.String),
-        )
-        .alias("authors")
+    # Stream all items including sub-collections, built directly as papers
+    store = zotero.open_store()
+    items = zotero.iter_items(zot, TARGET_COLLECTION_ID, store, cls=Paper)
+    # Answers of papers merged from other sources, see merge.py
+    known = reusable_answers() if PAPERS_PATH.exists() else {}
+    # Process abstracts, finished papers are kept in the checkpoint across runs
+    with Checkpoint(Path("./output") / "zotero_checkpoint.jsonl") as checkpoint:
+        papers = asyncio.run(process_papers(items, zot, store, checkpoint, known))
+
+    # Create DataFrame from the checkpoint, failed papers are left for the next run
+    df = pl.DataFrame(
+        [checkpoint.records[paper.id] for paper in papers if paper.id in checkpoint]
     )
-    print(df)
-    # Flatten authors column to string before export to CSV
+    # Authors are a list of {"name": ...} structs, keep the names only
     df = df.with_columns(
-        pl.col("authors")
-        .map_elements(lambda authors: ", ".join(authors), return_dtype=pl.String)
-        .alias("authors"),
+        pl.col("authors").list.eval(pl.element().struct.field("name")),
+        pl.col("date").str.slice(0, 4).alias("year"),
     )
-    df.write_csv(Path(".") / "output" / "zotero_items.csv")
+    print(df)
+    # Parquet dataset of processed papers, partitioned by publication year
+    reset_dataset(ZOTERO_DATASET_PATH)
+    write_dataset(df, ZOTERO_DATASET_PATH, "year")
+    if WRITE_CSV:
+        # CSV has no list type, join the author names
+        df.drop("year").with_columns(pl.col("authors").list.join(", ")).write_csv(
+            OUTPUT_DIR / "zotero_items.csv"
+        )
@@ -0,0 +1,262 @@
+import json
+import re
+from dataclasses import dataclass, field
+from typing import Literal, TypeVar
+from pydantic import BaseModel, ValidationError, field_validator
+
+# Appended to a prompt when its answer could not be parsed, see `RetryQueue`
+RETRY_INSTRUCTION = """
+    Your previous answer could not be parsed. Answer with a single valid JSON value
+    only, without any comment, markdown or text around it.
+    """
+# Opening and closing characters of JSON containers
+CLOSERS = {"{": "}", "[": "]"}
+FENCE_PATTERN = re.compile(r"```(?:json)?\s*(.*?)```", re.DOTALL | re.IGNORECASE)
+TRAILING_COMMA_PATTERN = re.compile(r",\s*([}\]])")
+LINE_COMMENT_PATTERN = re.compile(r"^\s*//.*$", re.MULTILINE)
+SMART_QUOTES = str.maketrans({"“": '"', "”": '"', "„": '"'})
+# strict=False accepts raw newlines inside strings, as in `parse`
+DECODER = json.JSONDecoder(strict=False)
+
+
+class ParseError(ValueError):
+    """
+    An LLM answer that does not validate against the expected model, even after
+    repair. The raw answer is kept for debugging and retries.
+    """
+
+    def __init__(self, message: str, content: str):
+        super().__init__(message)
+        self.content = content
+
+
+def normalize_yes_no(value):
+    """
+    Accept the usual variations of a Yes/No answer ("yes", "No.", " YES ").
+    """
+    if isinstance(value, str):
+        return value.strip().strip(".!").capitalize()
+    return value
+
+
+class IsAgtechAnswer(BaseModel):
+    """
+    Answer of `llm.IS_AGTECH_PROMPT`.
+    """
+
+    is_agtech: Literal["Yes", "No"]
+    sentence: str = ""
+    reason: str = ""
+
+    _normalize = field_validator("is_agtech", mode="before")(normalize_yes_no)
+
+
+class TechnologyAnswer(BaseModel):
+    """
+    Answer of `llm.TECHNOLOGY_PROMPT`, free text.
+    """
+
+    technology: str
+
+
+class LocationAnswer(BaseModel):
+    """
+    Answer of `llm.LOCATION_PROMPT`, free text.
+    """
+
+    location: str
+
+
+class ParticipantsAnswer(BaseModel):
+    """
+    Answer of `llm.PARTICIPANTS_PROMPT`, free text.
+    """
+
+    participants: str
+
+
+class AbstractExtraction(BaseModel):
+    """
+    Structured answer of the combined extraction prompt.
+    """
+
+    is_agtech: Literal["Yes", "No"]
+    sentence: str
+    reason: str
+    technology: str
+    location: str
+    participants: str
+
+    _normalize = field_validator("is_agtech", mode="before")(normalize_yes_no)
+
+
+class BatchAnswer(BaseModel):
+    """
+    One item of the reply to the batched is_agtech prompt.
+    """
+
+    id: str
+    is_agtech: Literal["Yes", "No"]
+    sentence: str
+    reason: str
+
+    _normalize = field_validator("is_agtech", mode="before")(normalize_yes_no)
+
+
+Model = TypeVar("Model", bound=BaseModel)
+
+
+def close_containers(text: str) -> str:
+    """
+    Close the strings, objects and arrays left open by a truncated answer.
+    """
+    stack, in_string, escaped = [], False, False
+    for char in text:
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in CLOSERS:
+            stack.append(CLOSERS[char])
+        elif stack and char == stack[-1]:
+            stack.pop()
+    return text + ('"' if in_string else "") + "".join(reversed(stack))
+
+
+def repair_json(content: str, opening: str = "{") -> str:
+    """
+    Best effort clean up of an LLM answer into JSON text:
+    markdown fences, text around the JSON, `//` comment lines, smart quotes,
+    trailing commas and containers left open by a truncated answer.
+    Objects without their braces (`"key": "value", ...`) are wrapped in braces.
+    The JSON value is decoded from its first opening character, so text after
+    it is ignored even if it has braces, and containers are only closed when
+    the value does not decode as it is.
+    """
+    if fenced := FENCE_PATTERN.search(content):
+        content = fenced.group(1)
+    content = LINE_COMMENT_PATTERN.sub("", content).translate(SMART_QUOTES)
+    start = content.find(opening)
+    if start == -1:
+        if opening != "{" or '":' not in content:
+            return content.strip()
+        content = "{" + content[content.find('"') :]
+        start = 0
+    content = content[start:]
+    for candidate in (content, TRAILING_COMMA_PATTERN.sub(r"\1", content)):
+        try:
+            _, end = DECODER.raw_decode(candidate)
+            return candidate[:end]
+        except json.JSONDecodeError:
+            pass
+    return TRAILING_COMMA_PATTERN.sub(r"\1", close_containers(content.rstrip(" \n,")))
+
+
+def parse(model: type[Model], content: str) -> Model:
+    """
+    Validate an LLM answer against a model.
+    Clean answers take the fast path: pydantic-core validates the raw JSON text
+    directly with the model's compiled validator. Anything else is repaired
+    with `repair_json` first. Raise `ParseError` if the answer still does not
+    validate.
+    """
+    try:
+        return model.model_validate_json(content)
+    except ValidationError:
+        pass
+    try:
+        # strict=False accepts raw newlines inside strings
+        data = json.loads(repair_json(content), strict=False)
+        return model.model_validate(data)
+    except (json.JSONDecodeError, ValidationError) as e:
+        raise ParseError(f"{model.__name__}: {e}", content) from e
+
+
+def parse_text(model: type[Model], content: str) -> Model:
+    """
+    Validate a free text answer of a single field model, such as
+    `TechnologyAnswer`. A JSON object with that field is accepted as well.
+    """
+    (name,) = model.model_fields
+    try:
+        return parse(model, content)
+    except ParseError:
+        pass
+    text = content.strip()
+    # A quoted answer loses its quotes, quotes inside the answer are kept
+    if len(text) > 1 and text[0] == text[-1] == '"' and '"' not in text[1:-1]:
+        text = text[1:-1].strip()
+    if not text:
+        raise ParseError(f"{model.__name__}: empty answer", content)
+    return model.model_validate({name: text})
+
+
+def parse_items(
+    model: type[Model], content: str
+) -> tuple[list[Model], list[ParseError]]:
+    """
+    Validate a JSON array answer item by item.
+    Return the valid items and an error for each invalid one, raise `ParseError`
+    if the answer is not an array at all.
+    """
+    try:
+        items = json.loads(repair_json(content, opening="["), strict=False)
+    except json.JSONDecodeError as e:
+        raise ParseError(f"list[{model.__name__}]: {e}", content) from e
+    if not isinstance(items, list):
+        raise ParseError(f"list[{model.__name__}]: not a JSON array", content)
+    valid, errors = [], []
+    for item in items:
+        try:
+            valid.append(model.model_validate(item))
+        except ValidationError as e:
+            errors.append(ParseError(f"{model.__name__}: {e}", json.dumps(item)))
+    return valid, errors
+
+
+@dataclass
+class RetryItem:
+    """
+    An unparseable answer: which prompt, for which text, and what went wrong.
+    """
+
+    key: str
+    template: str
+    text: str
+    content: str
+    error: str
+    attempts: int = 1
+
+
+@dataclass
+class RetryQueue:
+    """
+    Answers that could not be parsed, to be asked again with `RETRY_INSTRUCTION`
+    instead of being dropped. Items that failed `max_attempts` times go to
+    `failed` and are not retried anymore.
+    """
+
+    max_attempts: int = 2
+    items: list[RetryItem] = field(default_factory=list)
+    failed: list[RetryItem] = field(default_factory=list)
+
+    def add(self, item: RetryItem):
+        if item.attempts >= self.max_attempts:
+            self.failed.append(item)
+        else:
+            self.items.append(item)
+
+    def drain(self) -> list[RetryItem]:
+        """
+        Take the items to retry out of the queue.
+        """
+        items, self.items = self.items, []
+        return items
+
+    def __len__(self) -> int:
+        return len(self.items)
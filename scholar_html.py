@@ -0,0 +1,225 @@
+import httpx
+import polars as pl
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass
+from link_resolver import normalize_link
+from lxml import html
+from pathlib import Path
+from typing import Callable, Iterable, Iterator
+from urllib.parse import parse_qs, urlencode, urljoin, urlparse
+
+SCHOLAR_URL = "https://scholar.google.com/scholar"
+# Saved result pages ("Save page as" in the browser), parsed by `__main__`
+PAGES_DIR = Path("./scholar_pages")
+LINKS_PATH = Path("./paper_links.txt")
+RESULTS_PATH = Path("./output") / "scholar_results.csv"
+RESULTS_PER_PAGE = 10
+# Delay between fetched pages, Scholar blocks clients that go too fast
+FETCH_DELAY = 5.0
+# Columns of the results CSV, see `save_results`. `url` is the link normalized by
+# `link_resolver`, the key the results are joined on by `merge`.
+RESULTS_SCHEMA = {
+    "cluster_id": pl.Utf8,
+    "title": pl.Utf8,
+    "link": pl.Utf8,
+    "pdf_link": pl.Utf8,
+    "byline": pl.Utf8,
+    "citations": pl.Int64,
+    "cited_by_id": pl.Utf8,
+    "url": pl.Utf8,
+}
+
+
+def has_class(name: str) -> str:
+    """
+    XPath condition matching elements with a CSS class.
+    """
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+
+# One result of the list, its footer links and its PDF side link
+RESULT_XPATH = f"//div[{has_class('gs_r')} and {has_class('gs_or')}]"
+TITLE_XPATH = f".//h3[{has_class('gs_rt')}]"
+BYLINE_XPATH = f".//div[{has_class('gs_a')}]"
+FOOTER_LINKS_XPATH = f".//div[{has_class('gs_fl')}]//a"
+PDF_LINK_XPATH = f".//div[{has_class('gs_ggs')}]//a/@href"
+# "[PDF]", "[BOOK]", "[CITATION]" markers in front of titles, with their short
+# forms ("[C]") used on narrow screens
+TITLE_MARKER_XPATH = ".//span[{}]".format(
+    " or ".join(has_class(name) for name in ("gs_ctc", "gs_ctu", "gs_ct1", "gs_ct2"))
+)
+
+
+@dataclass
+class ScholarResult:
+    """
+    One result of a Google Scholar result page.
+    `cluster_id` identifies the paper (all its versions) on Scholar, it is the
+    `cluster=` parameter of its "All N versions" link and None for papers with a
+    single version. `cited_by_id` is the `cites=` parameter of its "Cited by" link.
+    """
+
+    cluster_id: str | None
+    title: str
+    link: str | None
+    pdf_link: str | None
+    byline: str
+    citations: int
+    cited_by_id: str | None
+
+
+def query_param(href: str, name: str) -> str | None:
+    return parse_qs(urlparse(href).query).get(name, [None])[0]
+
+
+def parse_result(element, base_url: str = SCHOLAR_URL) -> ScholarResult:
+    titles = element.xpath(TITLE_XPATH)
+    title = titles[0] if titles else None
+    link = None
+    if title is not None:
+        for marker in title.xpath(TITLE_MARKER_XPATH):
+            marker.drop_tree()
+        if anchors := title.xpath(".//a/@href"):
+            link = urljoin(base_url, anchors[0])
+    citations, cited_by_id, cluster_id = 0, None, None
+    for anchor in element.xpath(FOOTER_LINKS_XPATH):
+        href = anchor.get("href", "")
+        if cluster := query_param(href, "cluster"):
+            cluster_id = cluster
+        if cites := query_param(href, "cites"):
+            cited_by_id = cites
+            # "Cited by 123", localized pages only differ in the words
+            digits = "".join(char for char in anchor.text_content() if char.isdigit())
+            citations = int(digits or 0)
+    byline = element.xpath(BYLINE_XPATH)
+    pdf_links = element.xpath(PDF_LINK_XPATH)
+    return ScholarResult(
+        cluster_id=cluster_id,
+        title=" ".join(title.text_content().split()) if title is not None else "",
+        link=link,
+        pdf_link=urljoin(base_url, pdf_links[0]) if pdf_links else None,
+        byline=" ".join(byline[0].text_content().split()) if byline else "",
+        citations=citations,
+        cited_by_id=cited_by_id,
+    )
+
+
+def parse_page(page: str | bytes, base_url: str = SCHOLAR_URL) -> list[ScholarResult]:
+    """
+    Parse all results of a Scholar result page.
+    """
+    document = html.fromstring(page)
+    return [parse_result(element, base_url) for element in document.xpath(RESULT_XPATH)]
+
+
+def parse_file(path: Path) -> list[ScholarResult]:
+    return parse_page(Path(path).read_bytes())
+
+
+def parse_files(
+    paths: Iterable[Path], workers: int | None = None
+) -> list[ScholarResult]:
+    """
+    Parse saved result pages in a process pool, results are kept in page order.
+    """
+    with ProcessPoolExecutor(workers) as pool:
+        return [
+            result
+            for results in pool.map(parse_file, list(paths))
+            for result in results
+        ]
+
+
+def http_fetcher(client: httpx.Client | None = None) -> Callable[[str], str]:
+    """
+    Fetcher getting pages over HTTP with a shared client.
+    Any callable taking a URL and returning the page (e.g. a headless browser)
+    can be used instead.
+    """
+    client = client or httpx.Client(
+        headers={"User-Agent": "Mozilla/5.0"}, follow_redirects=True, timeout=30
+    )
+
+    def fetch(url: str) -> str:
+        response = client.get(url)
+        response.raise_for_status()
+        return response.text
+
+    return fetch
+
+
+def page_url(query: str, page: int) -> str:
+    return f"{SCHOLAR_URL}?{urlencode({'q': query, 'start': page * RESULTS_PER_PAGE})}"
+
+
+def fetch_results(
+    query: str,
+    pages: int,
+    fetch: Callable[[str], str] | None = None,
+    delay: float = FETCH_DELAY,
+) -> Iterator[ScholarResult]:
+    """
+    Fetch and parse result pages of a query, stopping at the first empty page.
+    """
+    fetch = fetch or http_fetcher()
+    for page in range(pages):
+        if page:
+            time.sleep(delay)
+        results = parse_page(fetch(page_url(query, page)))
+        if not results:
+            return
+        yield from results
+
+
+def save_results(
+    results: list[ScholarResult],
+    links_path: Path = LINKS_PATH,
+    results_path: Path = RESULTS_PATH,
+):
+    """
+    Append the new links to `paper_links.txt`, the ones already in it are
+    skipped so parsing the same pages again does not duplicate them.
+    Every field is merged into the results CSV the same way: results of earlier
+    calls are kept, and a result with the same title and link is only saved once.
+    The normalized link is saved with them, results saved before it was are
+    given one.
+    """
+    saved = set(links_path.read_text().splitlines()) if links_path.exists() else set()
+    links = dict.fromkeys(
+        result.link for result in results if result.link and result.link not in saved
+    )
+    with links_path.open("a") as fp:
+        for link in links:
+            fp.write(link + "\n")
+    frames = [
+        pl.DataFrame(
+            [
+                {**asdict(result), "url": result.link and normalize_link(result.link)}
+                for result in results
+            ],
+            schema=RESULTS_SCHEMA,
+        )
+    ]
+    if results_path.exists():
+        saved = pl.read_csv(results_path, infer_schema=False)
+        if "url" not in saved.columns:
+            urls = [link and normalize_link(link) for link in saved["link"]]
+            saved = saved.with_columns(pl.Series("url", urls, pl.Utf8))
+        frames.insert(
+            0,
+            saved.select(
+                pl.col(name).cast(dtype) for name, dtype in RESULTS_SCHEMA.items()
+            ),
+        )
+    results_path.parent.mkdir(parents=True, exist_ok=True)
+    pl.concat(frames).unique(
+        ["title", "link"], keep="first", maintain_order=True
+    ).write_csv(results_path)
+
+
+if __name__ == "__main__":
+    paths = sorted(PAGES_DIR.glob("*.htm*"))
+    results = parse_files(paths)
+    print(f"Parsed {len(results)} results from {len(paths)} pages")
+    save_results(results)
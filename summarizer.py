@@ -0,0 +1,178 @@
+import functools
+import nltk
+import numpy as np
+import polars as pl
+from concurrent.futures import ProcessPoolExecutor
+from nltk.corpus import stopwords
+from nltk.tokenize import sent_tokenize, word_tokenize
+from pathlib import Path
+from scipy.sparse import csr_matrix
+from scipy.sparse.linalg import svds
+from tqdm import tqdm
+import pdf_text
+
+# NLTK resources used by the summarizer and where NLTK keeps them
+NLTK_RESOURCES = {
+    "stopwords": "corpora/stopwords",
+    "punkt_tab": "tokenizers/punkt_tab",
+}
+
+
+@functools.cache
+def load_stop_words() -> frozenset[str]:
+    """
+    Load the NLTK resources once per process, downloading only missing ones.
+    Return the English stop words.
+    """
+    for resource, path in NLTK_RESOURCES.items():
+        try:
+            nltk.data.find(path)
+        except LookupError:
+            nltk.download(resource, quiet=True)
+    return frozenset(stopwords.words("english"))
+
+
+def term_matrix(sentences: list[str]) -> csr_matrix:
+    """
+    Sparse sentence × term count matrix.
+    Each sentence is tokenized once, stop words and non-alphabetic tokens are dropped.
+    """
+    stop_words = load_stop_words()
+    vocabulary: dict[str, int] = {}
+    rows, columns = [], []
+    for row, sentence in enumerate(sentences):
+        for word in word_tokenize(sentence):
+            word = word.lower()
+            if word.isalpha() and word not in stop_words:
+                rows.append(row)
+                columns.append(vocabulary.setdefault(word, len(vocabulary)))
+    return csr_matrix(
+        (np.ones(len(rows)), (rows, columns)),
+        shape=(len(sentences), len(vocabulary)),
+    )
+
+
+def frequency_scores(counts: csr_matrix) -> np.ndarray:
+    """
+    Score each sentence by the total count, over the text, of the distinct words
+    it contains.
+    """
+    frequency = np.asarray(counts.sum(axis=0)).ravel()
+    presence = counts.copy()
+    presence.data[:] = 1
+    return presence @ frequency
+
+
+def lsa_scores(counts: csr_matrix, topics: int = 5) -> np.ndarray:
+    """
+    LSA sentence scores (Steinberger & Ježek): length of each sentence's vector in
+    the latent topic space of a TF-IDF weighted term matrix, weighted by the
+    singular values.
+    """
+    n_sentences = counts.shape[0]
+    document_frequency = np.bincount(counts.indices, minlength=counts.shape[1])
+    idf = np.log(n_sentences / document_frequency)
+    weights = counts.multiply(idf).tocsr()
+    # Words found in every sentence have an idf of 0
+    weights.eliminate_zeros()
+    if not weights.nnz:
+        return frequency_scores(counts)
+    # svds needs k < min(matrix shape)
+    k = min(topics, min(weights.shape) - 1)
+    if k < 1:
+        return np.asarray(weights.sum(axis=1)).ravel()
+    u, sigma, _ = svds(weights, k=k)
+    return np.sqrt(((u * sigma) ** 2).sum(axis=1))
+
+
+def summarize(
+    text: str, method: str = "frequency", ratio: float = 1.2, length: int = 10
+) -> str:
+    """
+    Extractive summary of a text, sentences are kept in their original order.
+    `method` is either:
+    - "frequency": keep sentences scoring above `ratio` times the average score
+    - "lsa": keep the `length` best sentences by LSA score
+    """
+    load_stop_words()
+    sentences = sent_tokenize(text)
+    if not sentences:
+        return ""
+    counts = term_matrix(sentences)
+    if method == "frequency":
+        scores = frequency_scores(counts)
+        # Sentences without any scored word are not part of the average
+        average = scores[scores > 0].mean() if scores.any() else 0
+        keep = np.flatnonzero(scores > ratio * average)
+    elif method == "lsa":
+        scores = lsa_scores(counts) if counts.nnz else np.zeros(len(sentences))
+        keep = np.sort(np.argsort(-scores, kind="stable")[:length])
+    else:
+        raise ValueError(f"Unknown summarization method: {method}")
+    return " ".join(sentences[index] for index in keep)
+
+
+def summarize_file(text_path: str, method: str = "frequency") -> str:
+    """
+    Summarize a text file cached by `pdf_text`.
+    """
+    return summarize(
+        " ".join(pdf_text.iter_cached_pages(Path(text_path))), method=method
+    )
+
+
+def try_summarize_file(
+    text_path: str, method: str = "frequency"
+) -> tuple[str | None, str | None]:
+    """
+    `summarize_file` returning its error instead of raising it, so one text does
+    not stop the summaries of the corpus. Return the summary and the error.
+    """
+    try:
+        return summarize_file(text_path, method), None
+    except Exception as e:
+        return None, f"{type(e).__name__}: {e}"
+
+
+def summarize_corpus(
+    pdf_dir: Path = pdf_text.PDF_DIR,
+    method: str = "frequency",
+    workers: int | None = None,
+) -> pl.DataFrame:
+    """
+    Summarize every PDF of a directory in parallel.
+    Texts are extracted (or read from the cache) with `pdf_text.extract_all`.
+    A text that fails to be summarized gets a null summary and its error.
+    """
+    extracted = [meta for meta in pdf_text.extract_all(pdf_dir) if "text" in meta]
+    with ProcessPoolExecutor(workers, initializer=load_stop_words) as pool:
+        results = list(
+            tqdm(
+                pool.map(
+                    try_summarize_file,
+                    [meta["text"] for meta in extracted],
+                    [method] * len(extracted),
+                ),
+                total=len(extracted),
+                desc="Summaries",
+            )
+        )
+    summaries, errors = zip(*results) if results else ((), ())
+    failed = sum(error is not None for error in errors)
+    if failed:
+        print(f"{failed} texts could not be summarized, see the error column")
+    return pl.DataFrame(
+        {
+            "source": [meta["source"] for meta in extracted],
+            "hash": [meta["hash"] for meta in extracted],
+            "summary": list(summaries),
+            "error": list(errors),
+        },
+        schema_overrides={"summary": pl.Utf8, "error": pl.Utf8},
+    )
+
+
+if __name__ == "__main__":
+    df = summarize_corpus()
+    print(df)
+    df.write_csv(Path(".") / "output" / "summaries.csv")
@@ -0,0 +1,41 @@
+from pathlib import Path
+from scholar_html import ScholarResult, parse_file, save_results
+
+FIXTURE = Path(__file__).parent / "fixtures" / "scholar_page.html"
+
+
+def test_parse_page():
+    results = parse_file(FIXTURE)
+    assert results == [
+        ScholarResult(
+            cluster_id="9876543210",
+            title="Precision agriculture technology adoption in Europe",
+            link="https://onlinelibrary.wiley.com/doi/abs/10.1111/soru.12233",
+            pdf_link="https://www.example.org/precision.pdf",
+            byline="J Doe, A Roe - Sociologia Ruralis, 2019 - Wiley Online Library",
+            citations=1234,
+            cited_by_id="1234567890123",
+        ),
+        ScholarResult(
+            cluster_id=None,
+            title="Digital agriculture: a citation without a link",
+            link=None,
+            pdf_link=None,
+            byline="B Smith - 2021",
+            citations=0,
+            cited_by_id=None,
+        ),
+    ]
+
+
+def test_save_results_skips_saved_links(tmp_path):
+    links_path = tmp_path / "paper_links.txt"
+    results_path = tmp_path / "scholar_results.csv"
+    results = parse_file(FIXTURE)
+    save_results(results[1:], links_path, results_path)
+    save_results(results, links_path, results_path)
+    save_results(results, links_path, results_path)
+    assert links_path.read_text().splitlines() == [
+        "https://onlinelibrary.wiley.com/doi/abs/10.1111/soru.12233"
+    ]
+    assert len(results_path.read_text().splitlines()) == 3
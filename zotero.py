@@ -1,10 +1,15 @@
-import json
+import functools
+import queue
+import threading
+import time
 import polars as pl
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import dotenv_values
 from datetime import date
 from pydantic.dataclasses import dataclass
-from pyzotero import zotero
-from pathlib import Path
+from pyzotero import zotero, zotero_errors
+from typing import Iterator
+from zotero_store import LEGACY_CACHE_PATH, ZoteroStore
 
 
 @dataclass
@@ -50,6 +55,60 @@ class ZoteroItem:
     abstract: str | None = None
 
 
+class ZoteroRecord:
+    """
+    Lightweight counterpart of ZoteroItem for bulk runs: plain attributes in
+    `__slots__` and no validation. Authors are `{"name": ...}` dicts and the date
+    is the raw string from Zotero.
+    """
+
+    __slots__ = (
+        "id",
+        "author_short",
+        "authors",
+        "title",
+        "type",
+        "publication",
+        "date",
+        "DOI",
+        "url",
+        "collections",
+        "pdf",
+        "abstract",
+    )
+
+    def __init__(
+        self,
+        id,
+        author_short,
+        authors,
+        title,
+        type,
+        publication,
+        date,
+        DOI,
+        url,
+        collections="",
+        pdf=False,
+        abstract=None,
+    ):
+        self.id = id
+        self.author_short = author_short
+        self.authors = authors
+        self.title = title
+        self.type = type
+        self.publication = publication
+        self.date = date
+        self.DOI = DOI
+        self.url = url
+        self.collections = collections
+        self.pdf = pdf
+        self.abstract = abstract
+
+    def as_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
 def create_zotero_client(config, library_type="group") -> zotero.Zotero:
     """
     Create a Zotero client using the API key and library ID from configuration.
@@ -63,14 +122,77 @@ def create_zotero_client(config, library_type="group") -> zotero.Zotero:
     )
 
 
-def get_all_collections(zot, collection_id) -> list[ZoteroCollection]:
+# Number of threads used to fetch collections concurrently
+WORKERS = 8
+# Rate-limit errors are named differently across pyzotero versions
+RATE_LIMIT_ERRORS = tuple(
+    getattr(zotero_errors, name)
+    for name in ("TooManyRequests", "TooManyRequestsError", "TooManyRetriesError")
+    if hasattr(zotero_errors, name)
+)
+
+
+def with_retries(request, attempts=5, delay=2.0):
+    """
+    Call `request()` and retry with exponential backoff when Zotero rate-limits us.
+    """
+    for attempt in range(attempts):
+        try:
+            return request()
+        except RATE_LIMIT_ERRORS:
+            if attempt == attempts - 1:
+                raise
+            time.sleep(delay * 2**attempt)
+
+
+def thread_clients(zot):
+    """
+    Return a function giving each thread its own copy of a Zotero client.
+    pyzotero keeps pagination state on the client, so it can't be shared.
+    """
+    local = threading.local()
+
+    def client() -> zotero.Zotero:
+        if not hasattr(local, "zot"):
+            local.zot = zotero.Zotero(
+                zot.library_id, zot.library_type.removesuffix("s"), zot.api_key
+            )
+        return local.zot
+
+    return client
+
+
+def get_all_collections(zot, collection_id, workers=WORKERS) -> list[ZoteroCollection]:
     """
     Retrieve all nested collections under a specific Zotero collection.
-    There is a built-in method `zot.all_collections(collection_id)` that retrieves sub-collections.
+    The tree is walked level by level, fetching the sub-collections of all
+    collections of a level concurrently with `workers` threads.
     This function will return a list of dictionaries with collection ID, name, and parent ID.
     """
+    client = thread_clients(zot)
+
+    def sub_collections(key):
+        zot = client()
+        return with_retries(lambda: zot.everything(zot.collections_sub(key)))
+
+    level = [with_retries(lambda: zot.collection(collection_id))]
+    raw_collections = list(level)
+    with ThreadPoolExecutor(workers) as pool:
+        while level:
+            parents = [
+                collection["data"]["key"]
+                for collection in level
+                if collection["meta"].get("numCollections", 0) > 0
+            ]
+            level = [
+                child
+                for children in pool.map(sub_collections, parents)
+                for child in children
+            ]
+            raw_collections.extend(level)
+
     collections: list[ZoteroCollection] = []
-    for collection in zot.all_collections(collection_id):
+    for collection in raw_collections:
         collections.append(
             ZoteroCollection(
                 id=collection["data"]["key"],
@@ -81,6 +203,87 @@ def get_all_collections(zot, collection_id) -> list[ZoteroCollection]:
     return collections
 
 
+def fetch_collection_items(
+    zot, collection_ids, workers=WORKERS, page_size=100
+) -> dict[str, dict]:
+    """
+    Fetch the raw items of several collections concurrently, following all pages.
+    Items found in several collections are returned once, keyed by item ID,
+    with their collection memberships merged.
+    """
+    client = thread_clients(zot)
+
+    def fetch(collection_id):
+        zot = client()
+        return collection_id, with_retries(
+            lambda: zot.everything(zot.collection_items(collection_id, limit=page_size))
+        )
+
+    items: dict[str, dict] = {}
+    with ThreadPoolExecutor(workers) as pool:
+        for collection_id, raw_items in pool.map(fetch, collection_ids):
+            for item in raw_items:
+                item = items.setdefault(item["data"]["key"], item)
+                memberships = item["data"].setdefault("collections", [])
+                if collection_id not in memberships:
+                    memberships.append(collection_id)
+    return items
+
+
+def iter_pages(
+    zot, collection_ids, workers=WORKERS, page_size=100
+) -> Iterator[list[dict]]:
+    """
+    Yield pages of raw items of several collections as soon as they are downloaded.
+    Collections are fetched concurrently with `workers` threads, pages arrive in
+    no particular order and an item in several collections is yielded once per
+    collection.
+    """
+    client = thread_clients(zot)
+    pages: queue.Queue = queue.Queue(maxsize=workers * 2)
+    stop = threading.Event()
+    finished = object()
+
+    def put(entry):
+        # Give up when the consumer stopped iterating, instead of blocking forever
+        while not stop.is_set():
+            try:
+                pages.put(entry, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def fetch(collection_id):
+        zot = client()
+        try:
+            page = with_retries(
+                lambda: zot.collection_items(collection_id, limit=page_size)
+            )
+            while page and not stop.is_set():
+                put(page)
+                page = with_retries(zot.follow)
+        finally:
+            put(finished)
+
+    with ThreadPoolExecutor(workers) as pool:
+        futures = [
+            pool.submit(fetch, collection_id) for collection_id in collection_ids
+        ]
+        try:
+            remaining = len(futures)
+            while remaining:
+                page = pages.get()
+                if page is finished:
+                    remaining -= 1
+                else:
+                    yield page
+            # Raise errors from the workers
+            for future in futures:
+                future.result()
+        finally:
+            stop.set()
+
+
 def extract_author_details(author_data) -> ZoteroAuthor:
     """
     Extract author details from the Zotero author data.
@@ -103,50 +306,175 @@ def extract_author_details(author_data) -> ZoteroAuthor:
         return ZoteroAuthor(name="Unknown Author")
 
 
-def get_all_items(zot, collection_id) -> list[ZoteroItem]:
+def raw_fields(item) -> dict:
+    """
+    Item fields from raw item data returned by the Zotero API, except authors.
+    """
+    return dict(
+        id=item["data"]["key"],
+        title=item["data"].get("title", ""),
+        author_short=item["meta"].get("creatorSummary"),
+        type=item["data"].get("itemType"),
+        publication=item["data"].get("publicationTitle"),
+        date=item["data"].get("date"),
+        DOI=item["data"].get("DOI"),
+        url=item["data"].get("url"),
+        collections=",".join(item["data"].get("collections", [])),
+        abstract=item["data"].get("abstractNote"),
+    )
+
+
+def item_from_raw(item, cls=ZoteroItem) -> ZoteroItem:
+    """
+    Build a ZoteroItem (or a subclass given as `cls`) from raw item data
+    returned by the Zotero API.
+    """
+    return cls(
+        authors=[
+            extract_author_details(author)
+            for author in item["data"].get("creators", [])
+        ],
+        **raw_fields(item),
+    )
+
+
+def record_from_raw(item) -> ZoteroRecord:
+    """
+    Build a ZoteroRecord from raw item data, skipping validation.
+    """
+    return ZoteroRecord(
+        authors=[
+            {
+                "name": author.get("name")
+                or f"{author.get('firstName', '')} {author.get('lastName', '')}"
+            }
+            for author in item["data"].get("creators", [])
+        ],
+        **raw_fields(item),
+    )
+
+
+def open_store() -> ZoteroStore:
+    """
+    Open the local item store, importing the old JSON cache the first time.
+    """
+    store = ZoteroStore()
+    if count := store.migrate_json():
+        print(f"Migrated {count} items from {LEGACY_CACHE_PATH} to {store.path}")
+    return store
+
+
+def get_all_items(
+    zot,
+    collection_id,
+    incremental=False,
+    store: ZoteroStore | None = None,
+    workers=WORKERS,
+) -> list[ZoteroItem]:
     """
     Retrieve items from a specific Zotero collections including sub-collections.
-    This function will return a list of items.
-    """
-    items = []
-    # Cache raw data to a temp file for debugging
-    cache_path = Path("./output") / "zotero_cache.json"
-    if not cache_path.exists():
-        with cache_path.open("w+") as fp:
-            json.dump({}, fp)
-    with cache_path.open("r") as fp:
-        cached_data = json.load(fp)
-    # Iterate through all sub-collections
-    for collection in get_all_collections(zot, collection_id):
-        # Iterate through all items in the collection
-        for item in zot.collection_items(collection.id):
-            # Used Zotero item ID as a key
-            if not cached_data.get(item["data"]["key"], None):
-                cached_data[item["data"]["key"]] = item
-            # Build ZoteroItem object
-            items.append(
-                ZoteroItem(
-                    id=item["data"]["key"],
-                    title=item["data"].get("title", ""),
-                    author_short=item["meta"].get("creatorSummary"),
-                    authors=[
-                        extract_author_details(author)
-                        for author in item["data"].get("creators", [])
-                    ],
-                    type=item["data"].get("itemType"),
-                    publication=item["data"].get("publicationTitle"),
-                    date=item["data"].get("date"),
-                    DOI=item["data"].get("DOI"),
-                    url=item["data"].get("url"),
-                    collections=",".join(item["data"].get("collections", [])),
-                    abstract=item["data"].get("abstractNote"),
+    This function will return a list of items, an item in several collections
+    is returned once. Collections are fetched concurrently with `workers` threads.
+    Raw item data is saved in the local store (`open_store()` by default).
+    With `incremental`, only items changed since the last run are downloaded,
+    see `sync_items`.
+    """
+    store = store or open_store()
+    if incremental:
+        return sync_items(zot, collection_id, store, workers=workers)
+
+    # Fetch items of all sub-collections, each item only once
+    collections = get_all_collections(zot, collection_id, workers)
+    raw_items = fetch_collection_items(zot, [c.id for c in collections], workers)
+    # Save raw data, used Zotero item ID as a key
+    store.upsert(raw_items.values())
+    # Build ZoteroItem object
+    return [item_from_raw(item) for item in raw_items.values()]
+
+
+def iter_items(
+    zot,
+    collection_id,
+    store: ZoteroStore | None = None,
+    lightweight=False,
+    cls=ZoteroItem,
+    page_size=100,
+    workers=WORKERS,
+) -> Iterator[ZoteroItem | ZoteroRecord]:
+    """
+    Incrementally sync the items of a collection and its sub-collections with the
+    local store, using Zotero library versions, and lazily yield them.
+    The first sync downloads every item and yields each page as soon as it
+    arrives, so callers can start working while later pages are downloading.
+    Later syncs only fetch items modified since the library version stored with
+    the items and drop deleted items, so a rerun without changes takes a single
+    request. The sync is only recorded once the iterator is exhausted.
+    Each item is yielded once, even if it belongs to several collections.
+    Items are built as `cls` (ZoteroItem or a subclass), or with `lightweight`
+    as ZoteroRecord objects that skip validation.
+    """
+    store = store or open_store()
+    build = (
+        record_from_raw if lightweight else functools.partial(item_from_raw, cls=cls)
+    )
+    state = store.get_meta("sync", {})
+    if state.get("collection") != collection_id:
+        state = {}
+    # Read the version before fetching, changes made during the sync are picked up
+    # by the next one
+    version = zot.last_modified_version()
+    since = state.get("version")
+
+    if since is None:
+        # First sync, stream every item of every collection
+        collections = [c.id for c in get_all_collections(zot, collection_id, workers)]
+        seen = set()
+        for page in iter_pages(zot, collections, workers, page_size):
+            store.upsert(page)
+            for item in page:
+                if item["data"]["key"] not in seen and not item["data"].get("deleted"):
+                    seen.add(item["data"]["key"])
+                    yield build(item)
+    else:
+        if since < version:
+            # Collections may have been added or moved since the last sync
+            collections = [
+                c.id for c in get_all_collections(zot, collection_id, workers)
+            ]
+            store.upsert(
+                with_retries(
+                    lambda: zot.everything(zot.items(since=since, limit=page_size))
                 )
             )
-    # Update cache file
-    with cache_path.open("w") as fp:
-        json.dump(cached_data, fp)
+            store.delete(
+                with_retries(lambda: zot.deleted(since=since)).get("items", [])
+            )
+        else:
+            # Nothing changed in the library
+            collections = state["collections"]
+        members = set(collections)
+        for item in store.values():
+            # Trashed items keep their collections, skip them as well
+            if not item["data"].get("deleted") and members.intersection(
+                item["data"].get("collections", [])
+            ):
+                yield build(item)
 
-    return items
+    store.set_meta(
+        "sync",
+        {"collection": collection_id, "version": version, "collections": collections},
+    )
+
+
+def sync_items(
+    zot, collection_id, store: ZoteroStore, page_size=100, workers=WORKERS
+) -> list[ZoteroItem]:
+    """
+    Incrementally sync a collection and return all its items, see `iter_items`.
+    """
+    return list(
+        iter_items(zot, collection_id, store, page_size=page_size, workers=workers)
+    )
 
 
 def get_item(zot, id) -> dict:
@@ -161,9 +489,9 @@ if __name__ == "__main__":
     config = dotenv_values(".env")
     zot = create_zotero_client(config)
 
-    # Retrieve all items including sub-collections
-    items = get_all_items(zot, config["COLLECTION_ID"])
-    df = pl.DataFrame(items)
+    # Retrieve all items including sub-collections, validation is not needed here
+    records = iter_items(zot, config["COLLECTION_ID"], lightweight=True)
+    df = pl.DataFrame([record.as_dict() for record in records])
     print(df)
 
     # Example: Retrieve item by DOI
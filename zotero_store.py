@@ -0,0 +1,130 @@
+import json
+import sqlite3
+from pathlib import Path
+from typing import Iterable, Iterator
+
+STORE_PATH = Path("./output") / "zotero_store.sqlite"
+# Files used before the store existed, imported once by `migrate_json`
+LEGACY_CACHE_PATH = Path("./output") / "zotero_cache.json"
+LEGACY_SYNC_STATE_PATH = Path("./output") / "zotero_sync.json"
+
+
+class ZoteroStore:
+    """
+    Local SQLite store of raw Zotero item data keyed by item ID.
+    Lookups go through the primary key index, every write is an atomic
+    transaction, and items are only decoded from JSON when they are read.
+    Small pieces of state such as the last synced library version are kept
+    in a separate `meta` table.
+    """
+
+    def __init__(self, path: Path = STORE_PATH):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # Items may be streamed from a worker thread, see `zotero.iter_items`
+        self.db = sqlite3.connect(self.path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        with self.db:
+            self.db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS items (
+                    key TEXT PRIMARY KEY,
+                    version INTEGER,
+                    data TEXT NOT NULL
+                )
+                """
+            )
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)"
+            )
+
+    def get(self, key: str) -> dict | None:
+        """
+        Return the raw data of an item, or None if it is not stored.
+        """
+        row = self.db.execute("SELECT data FROM items WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def __contains__(self, key) -> bool:
+        return (
+            self.db.execute("SELECT 1 FROM items WHERE key = ?", (key,)).fetchone()
+            is not None
+        )
+
+    def __len__(self) -> int:
+        return self.db.execute("SELECT COUNT(*) FROM items").fetchone()[0]
+
+    def keys(self) -> list[str]:
+        return [row[0] for row in self.db.execute("SELECT key FROM items")]
+
+    def values(self) -> Iterator[dict]:
+        """
+        Lazily iterate over the raw data of all stored items.
+        """
+        for (data,) in self.db.execute("SELECT data FROM items"):
+            yield json.loads(data)
+
+    def upsert(self, items: Iterable[dict]) -> int:
+        """
+        Insert or replace raw items in one transaction, return how many were written.
+        """
+        with self.db:
+            cursor = self.db.executemany(
+                "INSERT OR REPLACE INTO items VALUES (?, ?, ?)",
+                (
+                    (item["data"]["key"], item.get("version"), json.dumps(item))
+                    for item in items
+                ),
+            )
+        return cursor.rowcount
+
+    def delete(self, keys: Iterable[str]) -> int:
+        """
+        Delete items in one transaction, return how many were removed.
+        """
+        with self.db:
+            cursor = self.db.executemany(
+                "DELETE FROM items WHERE key = ?", ((key,) for key in keys)
+            )
+        return cursor.rowcount
+
+    def get_meta(self, name: str, default=None):
+        row = self.db.execute(
+            "SELECT value FROM meta WHERE name = ?", (name,)
+        ).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set_meta(self, name: str, value):
+        with self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO meta VALUES (?, ?)", (name, json.dumps(value))
+            )
+
+    def migrate_json(
+        self,
+        cache_path: Path = LEGACY_CACHE_PATH,
+        sync_state_path: Path = LEGACY_SYNC_STATE_PATH,
+    ) -> int:
+        """
+        One-time import of the old `zotero_cache.json` (and its sync state) into
+        the store. The JSON files are left untouched.
+        Return the number of imported items, 0 if there was nothing to migrate.
+        """
+        if self.get_meta("migrated") or not cache_path.exists():
+            return 0
+        with cache_path.open("r") as fp:
+            count = self.upsert(json.load(fp).values())
+        if sync_state_path.exists():
+            with sync_state_path.open("r") as fp:
+                self.set_meta("sync", json.load(fp))
+        self.set_meta("migrated", str(cache_path))
+        return count
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()